@@ -1,17 +1,32 @@
-from flask import Flask, render_template, request, jsonify
-from models import init_db, DatabaseManager, get_timestamp
+from dotenv import load_dotenv
+
+# 各模块在导入时读取配置（连接池大小、教务系统地址、进程数等），必须先加载 .env
+load_dotenv()
+
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from models import init_db, DatabaseManager, STATEMENTS, user_roster, get_timestamp
 from utils.crypto import generate_key, encrypt_session
 from utils.score_monitor import serialize_session, fetch_scores, restore_session
 from utils.dingtalk import notify_init_scores
-from dotenv import load_dotenv
 from main import simulate_login
-from utils.session_manager import get_session, reset_session
+from utils.session_manager import new_login_session
+from utils.session_cache import session_cache
 from scheduler import start_scheduler, stop_scheduler
+from utils.captcha_ocr import start_ocr_pool, stop_ocr_pool
 import os
 import atexit
+import multiprocessing
 from utils.logger import logger
-
-load_dotenv()
+from utils.log_reader import tail_lines, read_from
+from utils.jobs import job_queue
+from utils.metrics import render_metrics
+import csv
+import io
+import json
+import re
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.urandom(24)
@@ -19,9 +34,23 @@ app.config["SECRET_KEY"] = os.urandom(24)
 FLASK_HOST = os.getenv("FLASK_HOST", "127.0.0.1")
 FLASK_PORT = int(os.getenv("FLASK_PORT", 5000))
 
-init_db()
-start_scheduler()
-atexit.register(stop_scheduler)
+USERS_PAGE_LIMIT = 50  # 用户列表默认每页数量
+USERS_PAGE_MAX = 500  # 用户列表每页最大数量
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", 4))  # 批量导入时并行登录的用户数
+BULK_IMPORT_MAX = 1000  # 单次批量导入的最大行数
+IMPORT_FIELDS = ("user_account", "user_password", "dingtalk_webhook", "dingtalk_secret")
+LOG_STREAM_INTERVAL = 1  # 日志推送检查新内容的间隔（秒）
+LOG_STREAM_HEARTBEAT = 15  # 日志推送无新内容时发送心跳的间隔（秒）
+
+# 分片检查进程（spawn）启动时会重新导入主模块，子进程中不初始化数据库和后台任务
+if multiprocessing.parent_process() is None:
+    init_db()
+    # OCR 工作进程通过 fork 创建，需在启动后台线程之前启动
+    start_ocr_pool()
+    atexit.register(stop_ocr_pool)
+    start_scheduler()
+    atexit.register(stop_scheduler)
+    atexit.register(job_queue.shutdown)
 
 
 # ========== 页面路由 ==========
@@ -67,71 +96,320 @@ def api_import():
     if not all([user_account, user_password, dingtalk_webhook, dingtalk_secret]):
         return jsonify({"success": False, "message": "所有字段都不能为空"})
 
+    job = job_queue.submit(
+        "import", _import_user, user_account, user_password, dingtalk_webhook, dingtalk_secret
+    )
+    return jsonify(
+        {"success": True, "message": f"用户 {user_account} 导入任务已提交", "job_id": job.id}
+    )
+
+
+def _login_user(user_account, user_password, dingtalk_webhook, dingtalk_secret):
+    """
+    登录教务系统并加密凭据
+
+    返回: (users 表的一行参数, 登录后的 session)，登录失败时返回 (None, None)
+    """
+    # 使用独立 session，避免与定时任务中的重新登录互相覆盖 Cookie
+    session = new_login_session()
+    if not simulate_login(user_account, user_password, session):
+        return None, None
+
+    encryption_key = generate_key()
+    encrypted_session = encrypt_session(serialize_session(session), encryption_key)
+    encrypted_password = encrypt_session(user_password, encryption_key)
+
+    timestamp = get_timestamp()
+    row = (
+        user_account,
+        encrypted_password,
+        encrypted_session,
+        encryption_key,
+        dingtalk_webhook,
+        dingtalk_secret,
+        timestamp,
+        timestamp,
+        timestamp,
+    )
+    return row, session
+
+
+def _save_users(rows):
+    """批量写入（覆盖）用户，并使相关缓存失效"""
+    with DatabaseManager() as conn:
+        conn.executemany(STATEMENTS["upsert_user"], rows)
+    for row in rows:
+        session_cache.invalidate(row[0])
+    user_roster.invalidate()
+
+
+def _send_initial_scores(user_account, session, dingtalk_webhook, dingtalk_secret):
+    """首次获取成绩并上报初始化信息"""
     try:
-        reset_session()
-        if not simulate_login(user_account, user_password):
-            return jsonify({"success": False, "message": "登录失败，请检查学号和密码"})
-
-        session = get_session()
-        session_data = serialize_session(session)
-
-        encryption_key = generate_key()
-        encrypted_session = encrypt_session(session_data, encryption_key)
-        encrypted_password = encrypt_session(user_password, encryption_key)
-
-        timestamp = get_timestamp()
-
-        with DatabaseManager() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT OR REPLACE INTO users (user_account, encrypted_password, encrypted_session, encryption_key, dingtalk_webhook, dingtalk_secret, enabled, session_expired, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, 1, 0, ?, ?)
-            """,
-                (
-                    user_account,
-                    encrypted_password,
-                    encrypted_session,
-                    encryption_key,
-                    dingtalk_webhook,
-                    dingtalk_secret,
-                    timestamp,
-                    timestamp,
-                ),
+        page_hash, scores, expired, _ = fetch_scores(session)
+        if scores and not expired:
+            logger.info(
+                f"用户 {user_account} 首次获取成绩成功，共 {len(scores)} 门"
             )
+            notify_init_scores(dingtalk_webhook, dingtalk_secret, scores, user_account)
+        elif not scores:
+            logger.info(f"用户 {user_account} 暂无成绩记录")
+            notify_init_scores(dingtalk_webhook, dingtalk_secret, [], user_account)
+    except Exception as e:
+        logger.error(f"用户 {user_account} 初始化获取成绩失败: {str(e)}")
+
+
+def _import_user(job, user_account, user_password, dingtalk_webhook, dingtalk_secret):
+    """导入单个用户（后台任务）：登录、保存、首次获取成绩并上报"""
+    job.progress(0, 3, "正在登录教务系统")
+    row, session = _login_user(user_account, user_password, dingtalk_webhook, dingtalk_secret)
+    if row is None:
+        return {"success": False, "message": "登录失败，请检查学号和密码"}
+
+    job.progress(1, message="正在保存用户")
+    _save_users([row])
+
+    job.progress(2, message="正在获取成绩")
+    _send_initial_scores(user_account, session, dingtalk_webhook, dingtalk_secret)
+
+    job.progress(3)
+    return {"success": True, "message": f"用户 {user_account} 导入成功，已开始监控"}
+
+
+def _parse_import_rows(text, fmt):
+    """
+    解析批量导入数据
+
+    参数:
+        fmt: "csv" 或 "jsonl"。CSV 可带表头（列名见 IMPORT_FIELDS），无表头时按该顺序取前 4 列
+    返回: [(行号, 字段字典)]，无法解析的行字段字典为 None
+    """
+    rows = []
+    if fmt == "jsonl":
+        for line_no, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            if not isinstance(item, dict):
+                rows.append((line_no, None))
+                continue
+            rows.append((line_no, {field: str(item.get(field) or "").strip() for field in IMPORT_FIELDS}))
+        return rows
+
+    header = None
+    for line_no, cols in enumerate(csv.reader(io.StringIO(text)), 1):
+        cols = [col.strip() for col in cols]
+        if not any(cols):
+            continue
+        if header is None and not rows and set(IMPORT_FIELDS) <= set(cols):
+            header = cols
+            continue
+        item = dict(zip(header or IMPORT_FIELDS, cols))
+        rows.append((line_no, {field: item.get(field, "") for field in IMPORT_FIELDS}))
+    return rows
+
+
+def _validate_import_rows(rows):
+    """校验全部导入数据，返回错误列表 [{"line", "message"}]"""
+    errors = []
+    seen = {}
+    for line_no, item in rows:
+        if item is None:
+            errors.append({"line": line_no, "message": "无法解析为 JSON 对象"})
+            continue
+        missing = [field for field in IMPORT_FIELDS if not item[field]]
+        if missing:
+            errors.append({"line": line_no, "message": f"缺少字段: {', '.join(missing)}"})
+            continue
+        user_account = item["user_account"]
+        if user_account in seen:
+            errors.append({"line": line_no, "message": f"学号 {user_account} 与第 {seen[user_account]} 行重复"})
+            continue
+        seen[user_account] = line_no
+    return errors
+
+
+@app.route("/api/import/bulk", methods=["POST"])
+def api_import_bulk():
+    """
+    批量导入用户（CSV 或 JSONL）
+
+    以 multipart 上传文件（字段名 file），或直接以请求体提交；
+    格式由 format 参数、文件扩展名或内容判断。所有行校验通过后才提交后台任务。
+    """
+    upload = request.files.get("file")
+    if upload is not None:
+        text = upload.read().decode("utf-8-sig", errors="replace")
+        filename = upload.filename or ""
+    else:
+        text = request.get_data(as_text=True)
+        filename = ""
+
+    fmt = request.args.get("format")
+    if fmt not in ("csv", "jsonl"):
+        if filename.endswith((".jsonl", ".json")) or text.lstrip().startswith("{"):
+            fmt = "jsonl"
+        else:
+            fmt = "csv"
+
+    rows = _parse_import_rows(text, fmt)
+    if not rows:
+        return jsonify({"success": False, "message": "导入数据为空"}), 400
+    if len(rows) > BULK_IMPORT_MAX:
+        return jsonify({"success": False, "message": f"单次最多导入 {BULK_IMPORT_MAX} 个用户"}), 400
+
+    errors = _validate_import_rows(rows)
+    if errors:
+        return jsonify(
+            {"success": False, "message": f"{len(errors)} 行数据有误，未导入任何用户", "errors": errors}
+        ), 400
 
-        # 首次获取成绩并上报初始化信息
+    job = job_queue.submit("bulk_import", _import_users, rows)
+    return jsonify(
+        {"success": True, "message": f"{len(rows)} 个用户的导入任务已提交", "job_id": job.id}
+    )
+
+
+def _import_users(job, rows):
+    """
+    批量导入用户（后台任务）
+
+    使用独立 session 并行登录，全部登录结束后一次性写入数据库，再并行获取首次成绩并上报。
+    """
+    total = len(rows)
+    job.progress(0, total, "正在登录教务系统")
+    completed = itertools.count(1)
+
+    def login(entry):
+        line_no, item = entry
         try:
-            page_hash, scores, expired = fetch_scores(session)
-            if scores and not expired:
-                logger.info(
-                    f"用户 {user_account} 首次获取成绩成功，共 {len(scores)} 门"
-                )
-                notify_init_scores(dingtalk_webhook, dingtalk_secret, scores, user_account)
-            elif not scores:
-                logger.info(f"用户 {user_account} 暂无成绩记录")
-                notify_init_scores(dingtalk_webhook, dingtalk_secret, [], user_account)
+            row, session = _login_user(*(item[field] for field in IMPORT_FIELDS))
         except Exception as e:
-            logger.error(f"用户 {user_account} 初始化获取成绩失败: {str(e)}")
-
-        return jsonify(
-            {"success": True, "message": f"用户 {user_account} 导入成功，已开始监控"}
-        )
+            logger.error(f"用户 {item['user_account']} 登录出错: {str(e)}")
+            row, session = None, None
+        job.progress(next(completed))
+        return line_no, item, row, session
+
+    with ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import") as executor:
+        logins = list(executor.map(login, rows))
+
+    succeeded = [(item, row, session) for _, item, row, session in logins if row is not None]
+    if succeeded:
+        job.progress(total, message="正在保存用户")
+        _save_users([row for _, row, _ in succeeded])
+
+        job.progress(total, message="正在获取成绩")
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import") as executor:
+            for item, _, session in succeeded:
+                executor.submit(
+                    _send_initial_scores,
+                    item["user_account"], session, item["dingtalk_webhook"], item["dingtalk_secret"],
+                )
 
-    except Exception as e:
-        return jsonify({"success": False, "message": str(e)})
+    results = [
+        {
+            "line": line_no,
+            "user_account": item["user_account"],
+            "success": row is not None,
+            "message": "导入成功" if row is not None else "登录失败，请检查学号和密码",
+        }
+        for line_no, item, row, _ in logins
+    ]
+    failed = total - len(succeeded)
+    return {
+        "success": True,
+        "message": f"批量导入完成：成功 {len(succeeded)} 个，失败 {failed} 个",
+        "imported": len(succeeded),
+        "failed": failed,
+        "results": results,
+    }
+
+
+def _user_filters(args):
+    """
+    根据查询参数构建用户列表的过滤条件
+
+    支持: enabled=0/1、expired=0/1、checked_after / checked_before（last_check_at 时间戳范围）、
+    q（学号前缀）
+    返回: (WHERE 子句列表, 参数列表)
+    """
+    clauses, params = [], []
+    for name, column in (("enabled", "enabled"), ("expired", "session_expired")):
+        value = args.get(name)
+        if value in ("0", "1"):
+            clauses.append(f"{column} = ?")
+            params.append(int(value))
+
+    checked_after = args.get("checked_after", type=int)
+    if checked_after is not None:
+        clauses.append("last_check_at >= ?")
+        params.append(checked_after)
+    checked_before = args.get("checked_before", type=int)
+    if checked_before is not None:
+        clauses.append("last_check_at < ?")
+        params.append(checked_before)
+
+    prefix = args.get("q", "").strip()
+    if prefix:
+        # 以范围条件匹配前缀，可以使用主键索引
+        clauses.append("user_account >= ? AND user_account < ?")
+        params.extend([prefix, prefix + "\U0010ffff"])
+    return clauses, params
+
+
+def _conditional_json(data):
+    """返回带 ETag 的 JSON 响应，内容未变化时返回 304"""
+    response = jsonify(data)
+    # 要求浏览器每次都携带 If-None-Match 重新验证
+    response.headers["Cache-Control"] = "no-cache"
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @app.route("/api/users", methods=["GET"])
 def api_users():
-    """获取用户列表"""
-    with DatabaseManager() as conn:
+    """
+    获取用户列表（按学号排序，游标分页）
+
+    参数: limit、cursor（上一页返回的 next_cursor）及 _user_filters 支持的过滤条件
+    """
+    limit = request.args.get("limit", USERS_PAGE_LIMIT, type=int)
+    limit = min(max(limit, 1), USERS_PAGE_MAX)
+
+    clauses, params = _user_filters(request.args)
+    cursor_value = request.args.get("cursor")
+    if cursor_value:
+        clauses.append("user_account > ?")
+        params.append(cursor_value)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    with DatabaseManager(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT user_account, enabled, session_expired, push_count, last_check_at, created_at, updated_at FROM users"
+            f"{STATEMENTS['list_users']}{where} ORDER BY user_account LIMIT ?",
+            (*params, limit + 1),
         )
         users = [dict(row) for row in cursor.fetchall()]
-    return jsonify({"success": True, "users": users})
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = users[-1]["user_account"]
+    return _conditional_json({"success": True, "users": users, "next_cursor": next_cursor})
+
+
+@app.route("/api/users/count", methods=["GET"])
+def api_users_count():
+    """统计用户数量，支持与 /api/users 相同的过滤条件"""
+    clauses, params = _user_filters(request.args)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    with DatabaseManager(readonly=True) as conn:
+        row = conn.execute(f"{STATEMENTS['count_users']}{where}", params).fetchone()
+    return _conditional_json({"success": True, **dict(row)})
 
 
 @app.route("/api/users/<user_account>", methods=["DELETE"])
@@ -139,8 +417,12 @@ def api_delete_user(user_account):
     """删除用户"""
     with DatabaseManager() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE user_account = ?", (user_account,))
-        cursor.execute("DELETE FROM scores WHERE user_account = ?", (user_account,))
+        cursor.execute(STATEMENTS["delete_user"], (user_account,))
+        cursor.execute(STATEMENTS["delete_user_scores"], (user_account,))
+        cursor.execute(STATEMENTS["delete_user_score_records"], (user_account,))
+        cursor.execute(STATEMENTS["delete_user_lease"], (user_account,))
+    session_cache.invalidate(user_account)
+    user_roster.invalidate()
     return jsonify({"success": True, "message": f"用户 {user_account} 已删除"})
 
 
@@ -149,10 +431,9 @@ def api_toggle_user(user_account):
     """切换用户启用状态"""
     with DatabaseManager() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET enabled = 1 - enabled WHERE user_account = ?",
-            (user_account,),
-        )
+        cursor.execute(STATEMENTS["toggle_user"], (user_account,))
+    session_cache.invalidate(user_account)
+    user_roster.invalidate()
     return jsonify({"success": True})
 
 
@@ -167,11 +448,36 @@ def api_check_user(user_account):
 
 @app.route("/api/check", methods=["POST"])
 def api_check():
-    """手动触发检测所有用户"""
+    """手动触发检测所有用户（后台任务），正在检测时返回同一个任务"""
+    job = job_queue.submit("check_all", _check_all_users, unique=True)
+    return jsonify({"success": True, "message": "全部用户检测已触发", "job_id": job.id})
+
+
+def _check_all_users(job):
+    """检测所有用户（后台任务）"""
     from scheduler import check_all_users
 
-    check_all_users()
-    return jsonify({"success": True, "message": "全部用户检测已触发"})
+    summary = check_all_users(progress=lambda done, total: job.progress(done, total))
+    return {
+        "success": True,
+        "message": f"检测完成：共 {summary['checked']} 个用户，失败 {summary['failed']}，超时 {summary['timed_out']}",
+        "summary": summary,
+    }
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job(job_id):
+    """查询后台任务的状态、进度和结果"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "任务不存在"}), 404
+    return jsonify({"success": True, "job": job.to_dict()})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/api/logs", methods=["GET"])
@@ -191,32 +497,87 @@ def api_logs():
     return jsonify({"success": True, "logs": logs})
 
 
-@app.route("/api/logs/<log_name>", methods=["GET"])
-def api_log_content(log_name):
-    """获取指定日志文件内容"""
-    import re
-
+def _log_path(log_name):
+    """校验日志文件名，返回日志路径；文件名无效或文件不存在时返回错误信息"""
     # 安全检查：只允许访问 logs 目录下的 .log 文件
     if not re.match(r'^app_\d{8}_\d{6}\.log$', log_name):
-        return jsonify({"success": False, "message": "无效的日志文件名"})
+        return None, "无效的日志文件名"
 
     log_path = os.path.join("logs", log_name)
     if not os.path.exists(log_path):
-        return jsonify({"success": False, "message": "日志文件不存在"})
+        return None, "日志文件不存在"
+    return log_path, None
+
+
+@app.route("/api/logs/<log_name>", methods=["GET"])
+def api_log_content(log_name):
+    """
+    获取指定日志文件内容
+
+    默认返回最后 lines 行；携带 offset（上次返回的字节偏移）时只返回之后新增的内容。
+    """
+    log_path, error = _log_path(log_name)
+    if error:
+        return jsonify({"success": False, "message": error})
 
     try:
+        offset = request.args.get("offset", type=int)
+        if offset is not None:
+            content, offset = read_from(log_path, offset)
+            return jsonify({"success": True, "content": content, "offset": offset})
+
         # 获取请求参数
         lines = request.args.get("lines", 200, type=int)
         lines = min(lines, 1000)  # 限制最大行数
 
-        with open(log_path, "r", encoding="utf-8") as f:
-            content = f.readlines()
-            # 返回最后 N 行
-            content = content[-lines:] if len(content) > lines else content
-            return jsonify({"success": True, "content": "".join(content), "total_lines": len(content)})
+        content, size = tail_lines(log_path, lines)
+        return jsonify({
+            "success": True,
+            "content": content,
+            "total_lines": content.count("\n"),
+            "offset": size,
+        })
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
 
+@app.route("/api/logs/<log_name>/stream", methods=["GET"])
+def api_log_stream(log_name):
+    """
+    以 Server-Sent Events 推送日志新增内容
+
+    从 offset（或断线重连时的 Last-Event-ID）开始推送，事件 id 为推送后的字节偏移。
+    """
+    log_path, error = _log_path(log_name)
+    if error:
+        return jsonify({"success": False, "message": error}), 404
+
+    offset = request.headers.get("Last-Event-ID", type=int)
+    if offset is None:
+        offset = request.args.get("offset", type=int)
+    if offset is None:
+        offset = os.path.getsize(log_path)
+
+    def generate(offset):
+        idle = 0
+        while True:
+            content, offset = read_from(log_path, offset)
+            if content:
+                idle = 0
+                yield f"id: {offset}\ndata: {json.dumps({'content': content, 'offset': offset}, ensure_ascii=False)}\n\n"
+                continue
+            idle += LOG_STREAM_INTERVAL
+            if idle >= LOG_STREAM_HEARTBEAT:
+                idle = 0
+                yield ": heartbeat\n\n"
+            time.sleep(LOG_STREAM_INTERVAL)
+
+    return Response(
+        stream_with_context(generate(offset)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     app.run(host=FLASK_HOST, port=FLASK_PORT)
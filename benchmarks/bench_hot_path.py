@@ -0,0 +1,203 @@
+"""
+单用户检查热路径微基准测试
+
+覆盖每次检查都会执行的函数：session 解密恢复、成绩页面获取与解析、成绩对比、
+session 序列化加密、钉钉签名和新成绩消息构建。成绩页面使用 fixtures 生成的
+10/60/150 门课程页面（固定随机种子，每次运行内容一致），无需网络。
+
+每项报告单次调用耗时和单次调用的峰值内存分配（tracemalloc），并与 baseline.json 对比；
+耗时超过基线 --threshold 倍的项目标记为退化。基线与机器相关，更换机器后请重新生成。
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_hot_path                    # 运行并与基线对比
+    python -m benchmarks.bench_hot_path -k fetch_scores    # 只运行名称包含 fetch_scores 的项目
+    python -m benchmarks.bench_hot_path --check            # 有退化时以非零状态码退出（用于 CI）
+    python -m benchmarks.bench_hot_path --save-baseline    # 以本次结果更新基线
+"""
+import os
+import sys
+import json
+import shutil
+import timeit
+import argparse
+import tempfile
+import itertools
+import tracemalloc
+import requests
+
+from benchmarks.fixtures import make_score_page
+from models import DatabaseManager
+from utils.crypto import generate_key, encrypt_session, decrypt_session
+from utils.score_monitor import (
+    restore_session, serialize_session, fetch_scores, compare_scores,
+    extract_table_html, page_fingerprint, score_fingerprint,
+)
+from utils.score_parser import parse_scores
+from utils.session_manager import new_login_session
+from utils.dingtalk import generate_sign, build_new_scores_message
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PAGE_SIZES = (10, 60, 150)
+DEFAULT_THRESHOLD = 1.5
+
+
+class _PageSession:
+    """返回固定成绩页面的 session，用于在不访问网络的情况下测试 fetch_scores"""
+
+    def __init__(self, page_text):
+        self.response = requests.Response()
+        self.response.status_code = 200
+        self.response._content = page_text.encode("utf-8")
+        self.response.encoding = "utf-8"
+        self.response.headers["Content-Type"] = "text/html;charset=UTF-8"
+
+    def get(self, url, headers=None, timeout=None):
+        return self.response
+
+
+def _login_session():
+    """构造与真实登录后相同结构的 session"""
+    session = new_login_session()
+    session.cookies.set("JSESSIONID", "0A1B2C3D4E5F60718293A4B5C6D7E8F9", path="/jsxsd")
+    session.cookies.set("SERVERID", "122", path="/")
+    return session
+
+
+def build_cases():
+    """
+    构建全部测试项
+
+    返回: [(名称, 无参函数)]
+    """
+    key = generate_key()
+    session = _login_session()
+    session_data = serialize_session(session)
+    encrypted_session = encrypt_session(session_data, key)
+
+    cases = [
+        ("decrypt_session", lambda: decrypt_session(encrypted_session, key)),
+        ("restore_session", lambda: restore_session(encrypted_session, key)),
+        ("serialize_session", lambda: serialize_session(session)),
+        ("encrypt_session", lambda: encrypt_session(session_data, key)),
+        ("generate_sign", lambda: generate_sign("SEC0123456789abcdef0123456789abcdef0123456789abcdef0123456789ab")),
+    ]
+
+    counter = itertools.count()
+    for size in PAGE_SIZES:
+        page = make_score_page(size)
+        page_session = _PageSession(page)
+        table_html = extract_table_html(page)
+        table_hash = page_fingerprint(page_session.response, table_html)
+        scores = parse_scores(table_html)
+        page_hash = score_fingerprint(scores)
+        user_account = f"bench{size}"
+        compare_scores(user_account, page_hash, scores, table_hash=table_hash)
+
+        cases += [
+            (f"fetch_scores[{size}]", lambda s=page_session: fetch_scores(s)),
+            (f"fetch_scores_unchanged[{size}]", lambda s=page_session, h=table_hash: fetch_scores(s, known_hash=h)),
+            (f"compare_scores_unchanged[{size}]", lambda u=user_account, p=page_hash, sc=scores, t=table_hash: compare_scores(u, p, sc, table_hash=t)),
+            # 成绩指纹每次都不同，走完整的逐课程对比（课程本身未变化，不产生通知）
+            (f"compare_scores_diff[{size}]", lambda u=user_account, sc=scores, t=table_hash: compare_scores(u, f"bench-{next(counter)}", sc, table_hash=t)),
+            (f"build_new_scores_message[{size}]", lambda sc=scores: build_new_scores_message(sc)),
+        ]
+    return cases
+
+
+def measure(func, number):
+    """
+    返回: (单次调用耗时（秒）, 单次调用峰值内存分配（字节）)
+    """
+    func()  # 预热（缓存、连接池等）
+    elapsed = min(timeit.repeat(func, number=number, repeat=5)) / number
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak - baseline
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def run(cases, number, baseline, threshold):
+    """
+    运行测试项并与基线对比
+
+    返回: (结果字典, 退化的项目名称列表)
+    """
+    results = {}
+    regressions = []
+    print(f"  {'项目':<34}{'耗时(us)':>12}{'峰值分配(KB)':>14}{'基线(us)':>12}{'对比':>8}")
+    for name, func in cases:
+        elapsed, peak = measure(func, number)
+        results[name] = {"time_us": round(elapsed * 1e6, 2), "peak_kb": round(peak / 1024, 2)}
+
+        expected = baseline.get(name, {}).get("time_us")
+        if expected:
+            ratio = elapsed * 1e6 / expected
+            mark = f"{ratio:.2f}x"
+            if ratio > threshold:
+                mark += " !"
+                regressions.append(name)
+        else:
+            expected, mark = "-", "新增"
+        print(f"  {name:<34}{results[name]['time_us']:>12}{results[name]['peak_kb']:>14}{expected:>12}{mark:>8}")
+    return results, regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="单用户检查热路径微基准测试")
+    arg_parser.add_argument("-n", "--number", type=int, default=200, help="每轮执行次数")
+    arg_parser.add_argument("-k", "--filter", help="只运行名称包含该字符串的项目")
+    arg_parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    arg_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="耗时超过基线多少倍视为退化")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="以本次结果更新基线")
+    arg_parser.add_argument("--check", action="store_true", help="有退化时以非零状态码退出")
+    args = arg_parser.parse_args()
+
+    # 成绩对比需要数据库，使用临时文件
+    workdir = tempfile.mkdtemp(prefix="qfnu-bench-")
+    DatabaseManager.DB_PATH = os.path.join(workdir, "monitor.db")
+    try:
+        cases = build_cases()
+        if args.filter:
+            cases = [(name, func) for name, func in cases if args.filter in name]
+
+        baseline = load_baseline(args.baseline)
+        results, regressions = run(cases, args.number, baseline, args.threshold)
+    finally:
+        DatabaseManager.close_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        if args.filter:
+            baseline.update(results)
+            results = baseline
+        save_baseline(args.baseline, results)
+        print(f"\n基线已保存到 {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\n{len(regressions)} 项耗时超过基线 {args.threshold} 倍: {', '.join(regressions)}")
+        return 1 if args.check else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
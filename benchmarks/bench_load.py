@@ -0,0 +1,225 @@
+"""
+端到端压测
+
+启动本地模拟教务系统（benchmarks/simulator.py），通过 /api/import/bulk 导入 N 个虚拟用户，
+再执行若干轮 check_all_users，报告每个阶段的耗时、CPU、内存和数据库连接池争用情况。
+
+数据库使用临时文件，不影响 monitor.db。模拟服务器默认与被测程序在同一进程中运行，
+CPU 时间包含模拟服务器的开销；需要单独统计时可先另行启动模拟服务器并使用 --base-url。
+分片检查模式（--sweep-processes）下 CPU 和内存只统计主进程。
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_load --users 200 --sweeps 3 --latency 0.05
+    python -m benchmarks.bench_load --users 500 --session-ttl 5 --sweep-pause 6   # 测试批量重新登录
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks.simulator import start_server, add_config_arguments, config_from_args
+
+
+def _usage():
+    """当前进程的 CPU 时间（秒）和峰值内存（MB）"""
+    cpu = time.process_time()
+    if resource is None:
+        return cpu, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return cpu, peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Phase:
+    """记录一个阶段的耗时、CPU 时间、峰值内存和连接池统计变化"""
+
+    def __init__(self, name):
+        self.name = name
+        self.result = {}
+
+    def __enter__(self):
+        from models import DatabaseManager
+
+        self._pool = DatabaseManager.pool_stats()
+        self._cpu, _ = _usage()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        from models import DatabaseManager
+
+        elapsed = time.perf_counter() - self._started
+        cpu, peak = _usage()
+        pool = DatabaseManager.pool_stats()
+        checkouts = pool.get("checkouts", 0) - self._pool.get("checkouts", 0)
+        wait_total = pool.get("wait_total", 0) - self._pool.get("wait_total", 0)
+        self.result.update(
+            {
+                "duration": round(elapsed, 3),
+                "cpu": round(cpu - self._cpu, 3),
+                "cpu_percent": round((cpu - self._cpu) / elapsed * 100, 1) if elapsed else 0.0,
+                "peak_rss_mb": round(peak, 1) if peak is not None else None,
+                "db_checkouts": checkouts,
+                "db_wait_total": round(wait_total, 4),
+                "db_wait_avg_ms": round(wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "db_wait_max": pool.get("wait_max", 0),
+                "db_timeouts": pool.get("timeouts", 0) - self._pool.get("timeouts", 0),
+            }
+        )
+        return False
+
+
+def _wait_job(client, job_id, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").get_json()["job"]
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(f"任务 {job_id} 未在 {timeout} 秒内完成")
+
+
+def run(args):
+    if args.base_url:
+        server, registrar, base_url = None, None, args.base_url.rstrip("/")
+    else:
+        server, registrar, base_url = start_server(config=config_from_args(args))
+
+    # 以下模块在导入时读取配置，必须先设置环境变量
+    os.environ["JWXT_BASE_URL"] = base_url
+    for name in ("SWEEP_WORKERS", "SWEEP_PROCESSES", "IMPORT_WORKERS", "HTTP_POOL_SIZE"):
+        value = getattr(args, name.lower())
+        if value:
+            os.environ[name] = str(value)
+
+    workdir = tempfile.mkdtemp(prefix="qfnu-bench-")
+    import models
+
+    models.DatabaseManager.DB_PATH = os.path.join(workdir, "monitor.db")
+
+    import app as monitor_app
+    import scheduler
+    from utils.dingtalk import dispatch_pending
+
+    # 由压测脚本驱动检查，不使用定时任务；钉钉发送线程照常运行
+    scheduler.scheduler.remove_all_jobs()
+    client = monitor_app.app.test_client()
+
+    report = {
+        "users": args.users,
+        "base_url": base_url,
+        "sweep_workers": scheduler.SWEEP_WORKERS,
+        "sweep_processes": scheduler.SWEEP_PROCESSES,
+        "import_workers": monitor_app.IMPORT_WORKERS,
+        "phases": [],
+    }
+
+    lines = ["user_account,user_password,dingtalk_webhook,dingtalk_secret"]
+    lines += [
+        f"{args.account_prefix}{i:06d},pw{i},{base_url}/robot/send?access_token=bench{i},SEC{i}"
+        for i in range(args.users)
+    ]
+    with Phase("import") as phase:
+        response = client.post("/api/import/bulk?format=csv", data="\n".join(lines))
+        data = response.get_json()
+        if not data.get("success"):
+            raise RuntimeError(f"导入失败: {data.get('message')}")
+        job = _wait_job(client, data["job_id"], args.timeout)
+        phase.result["imported"] = job["result"]["imported"]
+        phase.result["failed"] = job["result"]["failed"]
+    report["phases"].append({"phase": phase.name, **phase.result})
+
+    for sweep in range(1, args.sweeps + 1):
+        if sweep > 1 and args.sweep_pause:
+            time.sleep(args.sweep_pause)
+        with Phase(f"sweep {sweep}") as phase:
+            summary = scheduler.check_all_users()
+        phase.result.update(
+            {
+                "checked": summary["checked"],
+                "failed": summary["failed"],
+                "timed_out": summary["timed_out"],
+                "statuses": summary["statuses"],
+                "latency_p50": summary["latency_p50"],
+                "latency_p95": summary["latency_p95"],
+            }
+        )
+        report["phases"].append({"phase": phase.name, **phase.result})
+
+    with Phase("outbox") as phase:
+        sent = 0
+        while True:
+            batch = dispatch_pending()
+            if not batch:
+                break
+            sent += batch
+        phase.result["sent"] = sent
+    report["phases"].append({"phase": phase.name, **phase.result})
+
+    if registrar is not None:
+        report["simulator"] = registrar.snapshot()
+        server.shutdown()
+    report["db_size_mb"] = round(os.path.getsize(models.DatabaseManager.DB_PATH) / 1024 / 1024, 2)
+    models.DatabaseManager.close_pool()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def print_report(report):
+    print(
+        f"\n{report['users']} 个用户，教务系统 {report['base_url']}，"
+        f"检查进程 {report['sweep_processes'] or 1} x 线程 {report['sweep_workers']}，导入线程 {report['import_workers']}"
+    )
+    print(
+        f"  {'阶段':<10}{'耗时(s)':>10}{'CPU(s)':>10}{'CPU%':>8}{'峰值内存MB':>12}"
+        f"{'DB取连接':>10}{'DB平均等待ms':>14}{'DB最长等待s':>12}"
+    )
+    for phase in report["phases"]:
+        peak = phase["peak_rss_mb"] if phase["peak_rss_mb"] is not None else "-"
+        print(
+            f"  {phase['phase']:<10}{phase['duration']:>10}{phase['cpu']:>10}{phase['cpu_percent']:>8}"
+            f"{peak:>12}{phase['db_checkouts']:>10}{phase['db_wait_avg_ms']:>14}{phase['db_wait_max']:>12}"
+        )
+        extra = {
+            key: value for key, value in phase.items()
+            if key in ("imported", "failed", "checked", "timed_out", "statuses", "latency_p50", "latency_p95", "sent")
+        }
+        print(f"  {'':<10}{json.dumps(extra, ensure_ascii=False)}")
+    if "simulator" in report:
+        print(f"  模拟服务器: {json.dumps(report['simulator'], ensure_ascii=False)}")
+    print(f"  数据库大小: {report['db_size_mb']} MB")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="端到端压测（本地模拟教务系统）")
+    arg_parser.add_argument("--users", type=int, default=200, help="虚拟用户数（单次导入最多 1000 个）")
+    arg_parser.add_argument("--sweeps", type=int, default=3, help="检查轮数")
+    arg_parser.add_argument("--sweep-pause", type=float, default=0, help="两轮检查之间的间隔（秒）")
+    arg_parser.add_argument("--sweep-workers", type=int, help="覆盖 SWEEP_WORKERS")
+    arg_parser.add_argument("--sweep-processes", type=int, help="覆盖 SWEEP_PROCESSES（分片检查进程数）")
+    arg_parser.add_argument("--import-workers", type=int, help="覆盖 IMPORT_WORKERS")
+    arg_parser.add_argument("--http-pool-size", type=int, help="覆盖 HTTP_POOL_SIZE")
+    arg_parser.add_argument("--account-prefix", default="2099", help="虚拟学号前缀")
+    arg_parser.add_argument("--timeout", type=float, default=600, help="导入任务最长等待时间（秒）")
+    arg_parser.add_argument("--base-url", help="使用已启动的模拟服务器，不在本进程内启动")
+    arg_parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    add_config_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
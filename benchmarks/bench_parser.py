@@ -0,0 +1,70 @@
+"""
+成绩表格解析基准测试
+
+对比各解析后端与旧实现（BeautifulSoup 解析整页）的耗时，并校验输出一致。
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_parser                 # 使用生成的 10/60/150 门课程页面
+    python -m benchmarks.bench_parser page1.html ...  # 使用保存下来的真实页面
+"""
+import sys
+import timeit
+import argparse
+from bs4 import BeautifulSoup
+
+from benchmarks.fixtures import make_score_page
+from utils.score_monitor import extract_table_html
+from utils.score_parser import PARSERS, SCORE_FIELDS, MIN_COLUMNS, lxml_html
+
+
+def parse_legacy(page_text):
+    """旧实现：BeautifulSoup 解析整个页面"""
+    soup = BeautifulSoup(page_text, 'html.parser')
+    table = soup.find('table', {'id': 'dataList'})
+    scores = []
+    for idx, row in enumerate(table.find_all('tr')[1:], 1):
+        cols = row.find_all('td')
+        if len(cols) >= MIN_COLUMNS:
+            score_info = {'序号': str(idx)}
+            score_info.update(zip(SCORE_FIELDS, (col.text.strip() for col in cols[1:MIN_COLUMNS])))
+            scores.append(score_info)
+    return scores
+
+
+def bench(name, page_text, number):
+    table_html = extract_table_html(page_text)
+    expected = parse_legacy(page_text)
+
+    candidates = {'legacy(bs4 整页)': lambda: parse_legacy(page_text)}
+    for backend, parser in PARSERS.items():
+        if backend == 'lxml' and lxml_html is None:
+            continue
+        candidates[backend] = (lambda p: lambda: p(extract_table_html(page_text)))(parser)
+        if parser(table_html) != expected:
+            print(f"[警告] {name}: {backend} 后端输出与旧实现不一致")
+
+    print(f"\n{name}（{len(expected)} 门课程，{len(page_text.encode()) // 1024} KB）")
+    baseline = None
+    for label, func in candidates.items():
+        elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number
+        baseline = baseline or elapsed
+        print(f"  {label:<18} {elapsed * 1000:8.3f} ms/次  {baseline / elapsed:6.1f}x")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="成绩表格解析基准测试")
+    arg_parser.add_argument("pages", nargs="*", help="保存的 cjcx_list 页面文件")
+    arg_parser.add_argument("-n", "--number", type=int, default=50, help="每轮执行次数")
+    args = arg_parser.parse_args()
+
+    if args.pages:
+        for path in args.pages:
+            with open(path, "r", encoding="utf-8") as f:
+                bench(path, f.read(), args.number)
+    else:
+        for count in (10, 60, 150):
+            bench(f"生成页面 {count} 门", make_score_page(count), args.number)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
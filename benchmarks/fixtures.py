@@ -0,0 +1,103 @@
+"""
+成绩页面样本生成
+
+按教务系统 kscj/cjcx_list 页面的结构生成指定课程数的页面，
+供基准测试和本地模拟使用，无需访问真实教务系统。
+"""
+import random
+
+PAGE_HEAD = """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head id="headerid1">
+<base target="_self" />
+<title>学期成绩</title>
+<meta http-equiv="pragma" content="no-cache" />
+<meta http-equiv="cache-control" content="no-cache" />
+<meta http-equiv="keywords" content="湖南强智科技教务系统" />
+<script type="text/javascript" src="/jsxsd/js/jquery-1.8.0.min.js" language="javascript"></script>
+<script type="text/javascript" src="/jsxsd/js/common.js" language="javascript"></script>
+<link href="/jsxsd/framework/images/common.css" rel="stylesheet" type="text/css" />
+<link href="/jsxsd/framework/images/blue.css" rel="stylesheet" type="text/css" id="link_theme" />
+</head>
+<body>
+<input type="hidden" name="token" value="{token}" />
+<div class="Nsb_pw">
+<div class="Nsb_layout_r">
+<div>显示课程：<span>全部</span>&nbsp;&nbsp;所修总学分：{credits} 绩点：{gpa}</div>
+<table id="dataList" class="Nsb_r_list Nsb_table" style="width:100%">
+<tr>
+<th class="Nsb_r_list_thb">序号</th><th>开课学期</th><th>课程编号</th><th>课程名称</th><th>分组名</th>
+<th>成绩</th><th>成绩标识</th><th>学分</th><th>总学时</th><th>绩点</th><th>补重学期</th>
+<th>考核方式</th><th>考试性质</th><th>课程属性</th><th>课程性质</th><th>课程类别</th>
+</tr>
+"""
+
+ROW = """<tr>
+<td>{idx}</td>
+<td>{term}</td>
+<td align="left">{course_id}</td>
+<td align="left">{name}</td>
+<td>{group}</td>
+<td style=""><a href="javascript:JsMod('/jsxsd/kscj/pscj_list.do?xs0101id=2022&amp;jx0404id={course_id}&amp;cj0708id={idx}&amp;zcj={grade}',700,500)">{grade}</a></td>
+<td>{flag}</td>
+<td>{credit}</td>
+<td>{hours}</td>
+<td>{point}</td>
+<td>{retake}</td>
+<td>{assessment}</td>
+<td>正常考试</td>
+<td>{attr}</td>
+<td>{nature}</td>
+<td>&nbsp;</td>
+</tr>
+"""
+
+PAGE_TAIL = """</table>
+</div>
+</div>
+<script type="text/javascript">
+var renderedAt = "{rendered_at}";
+</script>
+</body>
+</html>
+"""
+
+TERMS = ["2022-2023-1", "2022-2023-2", "2023-2024-1", "2023-2024-2", "2024-2025-1", "2024-2025-2"]
+GRADES = ["95", "88", "76", "63", "优秀", "良好", "中等", "及格", "合格"]
+
+
+def make_score_rows(course_count, seed=0):
+    """生成 course_count 门课程的行数据"""
+    rng = random.Random(seed)
+    rows = []
+    for idx in range(1, course_count + 1):
+        grade = rng.choice(GRADES)
+        rows.append(
+            {
+                "idx": idx,
+                "term": TERMS[(idx - 1) * len(TERMS) // max(course_count, 1)],
+                "course_id": f"{rng.randint(1000000, 9999999)}",
+                "name": f"课程{idx}",
+                "group": "",
+                "grade": grade,
+                "flag": "",
+                "credit": rng.choice(["1.0", "2.0", "3.0", "4.0"]),
+                "hours": rng.choice(["16", "32", "48", "64"]),
+                "point": f"{rng.uniform(1, 5):.1f}",
+                "retake": "",
+                "assessment": rng.choice(["考试", "考查"]),
+                "attr": rng.choice(["必修", "选修"]),
+                "nature": rng.choice(["专业必修课", "通识教育课", "专业选修课"]),
+            }
+        )
+    return rows
+
+
+def make_score_page(course_count, seed=0, token="0", rendered_at="2026-01-21 09:35:54", rows=None):
+    """生成包含 course_count 门课程的成绩页面"""
+    rows = rows if rows is not None else make_score_rows(course_count, seed)
+    return (
+        PAGE_HEAD.format(token=token, credits=course_count * 2, gpa="3.21")
+        + "".join(ROW.format(**row) for row in rows)
+        + PAGE_TAIL.format(rendered_at=rendered_at)
+    )
@@ -0,0 +1,341 @@
+"""
+本地教务系统模拟服务器
+
+模拟强智教务系统中监控用到的页面，用于压测和本地调试，不访问真实教务系统：
+    /jsxsd/                        首页，下发 JSESSIONID
+    /jsxsd/verifycode.servlet      验证码图片
+    /jsxsd/xk/LoginToXkLdap        登录
+    /jsxsd/kscj/cjcx_list          成绩页面（session 过期时返回登录页）
+    /jsxsd/framework/xsMain.jsp    个人中心（保活）
+    /robot/send                    钉钉机器人（直接返回成功）
+    /__stats                       模拟服务器的请求统计
+
+响应延迟、出错率、session 空闲过期时间、成绩表格大小、新成绩出现概率均可配置。
+
+用法（在项目根目录执行）:
+    python -m benchmarks.simulator --port 8800 --latency 0.05 --error-rate 0.01
+    JWXT_BASE_URL=http://127.0.0.1:8800 python app.py   # 也可以写入 .env
+"""
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import argparse
+import threading
+from io import BytesIO
+from collections import Counter
+from dataclasses import dataclass
+from http.cookies import SimpleCookie
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image, ImageDraw
+
+from benchmarks.fixtures import make_score_rows, make_score_page
+
+CAPTCHA_CHARS = "abcdefghjkmnpqrstuvwxyz23456789"
+
+LOGIN_PAGE = """<html><head><title>用户登录</title></head><body>
+<form action="/jsxsd/xk/LoginToXkLdap" method="post">
+<input type="text" name="RANDOMCODE" placeholder="请输入验证码" />
+</form>
+<font color="red">{error}</font>
+</body></html>"""
+
+MAIN_PAGE = """<html><head><title>学生个人中心</title></head><body>
+<div class="Nsb_top_menu_nc">{account}</div>
+</body></html>"""
+
+
+@dataclass
+class SimulatorConfig:
+    latency: float = 0.05  # 平均响应延迟（秒），实际延迟在 0.5~1.5 倍之间随机
+    error_rate: float = 0.0  # 返回 500 的概率
+    session_ttl: float = 1800  # session 空闲过期时间（秒）
+    courses: int = 60  # 每个用户初始的课程数
+    new_score_rate: float = 0.0  # 每次查询成绩时出现一门新成绩的概率
+    captcha_error_rate: float = 0.0  # 验证码被判定为错误的概率
+    strict_captcha: bool = False  # 是否要求验证码与图片内容一致（使用真实 OCR 时可开启）
+
+
+class _Session:
+    __slots__ = ("captcha", "account", "last_seen")
+
+    def __init__(self):
+        self.captcha = None
+        self.account = None
+        self.last_seen = time.monotonic()
+
+
+class Registrar:
+    """模拟教务系统的状态：session、每个用户的成绩和请求统计"""
+
+    def __init__(self, config=None, seed=0):
+        self.config = config or SimulatorConfig()
+        self.rng = random.Random(seed)
+        self.sessions = {}
+        self.scores = {}  # 学号 -> 成绩行
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["sessions"] = len(self.sessions)
+            stats["users"] = len(self.scores)
+        return stats
+
+    def new_session(self):
+        session_id = uuid.uuid4().hex.upper()
+        with self._lock:
+            self.sessions[session_id] = _Session()
+        return session_id
+
+    def get_session(self, session_id):
+        """获取 session，空闲超过 session_ttl 的 session 视为不存在"""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            now = time.monotonic()
+            if now - session.last_seen > self.config.session_ttl:
+                del self.sessions[session_id]
+                self.stats["sessions_expired"] += 1
+                return None
+            session.last_seen = now
+            return session
+
+    def new_captcha(self, session):
+        with self._lock:
+            session.captcha = "".join(self.rng.choice(CAPTCHA_CHARS) for _ in range(4))
+        return session.captcha
+
+    def login(self, session, code, encoded):
+        """校验登录请求，返回错误信息，成功时返回 None"""
+        with self._lock:
+            expected, session.captcha = session.captcha, None
+            rejected = self.rng.random() < self.config.captcha_error_rate
+        if expected is None or rejected or (
+            self.config.strict_captcha and code.lower() != expected
+        ):
+            return "验证码错误!!"
+        try:
+            account_b64, _ = encoded.split("%%%", 1)
+            account = base64.b64decode(account_b64).decode()
+        except Exception:
+            return "该帐号不存在或密码错误,请联系管理员!"
+        session.account = account
+        return None
+
+    def score_page(self, account):
+        """生成用户的成绩页面，按 new_score_rate 的概率追加一门新成绩"""
+        with self._lock:
+            rows = self.scores.get(account)
+            if rows is None:
+                seed = sum(account.encode())
+                rows = self.scores[account] = make_score_rows(self.config.courses, seed=seed)
+            elif self.rng.random() < self.config.new_score_rate:
+                extra = make_score_rows(len(rows) + 1, seed=self.rng.random())[-1]
+                rows.append(extra)
+                self.stats["new_scores"] += 1
+            rows = list(rows)
+        return make_score_page(len(rows), token=uuid.uuid4().hex, rendered_at=time.ctime(), rows=rows)
+
+
+def _captcha_image(text):
+    """绘制验证码图片（PNG）"""
+    image = Image.new("RGB", (80, 30), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for i, char in enumerate(text):
+        draw.text((8 + i * 17, 8), char, fill=(20, 60, 160))
+    for x in range(0, 80, 7):
+        draw.line((x, 0, 80 - x, 30), fill=(200, 200, 200))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class RegistrarHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive，与真实服务器一致
+    registrar = None  # 由 make_server 设置
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="text/html;charset=UTF-8", cookie=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if cookie:
+            self.send_header("Set-Cookie", f"JSESSIONID={cookie}; Path=/jsxsd")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _session_id(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        morsel = cookie.get("JSESSIONID")
+        return morsel.value if morsel else None
+
+    def _delay(self):
+        """模拟响应延迟，按 error_rate 返回 True 表示本次请求应失败"""
+        config = self.registrar.config
+        if config.latency > 0:
+            time.sleep(config.latency * random.uniform(0.5, 1.5))
+        if config.error_rate > 0 and random.random() < config.error_rate:
+            self.registrar.count("errors")
+            self._send(500, "<html><body>Internal Server Error</body></html>")
+            return True
+        return False
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        registrar = self.registrar
+        if path == "/__stats":
+            self._send(200, json.dumps(registrar.snapshot()), "application/json")
+            return
+
+        registrar.count(f"GET {path}")
+        if self._delay():
+            return
+
+        session_id = self._session_id()
+        session = registrar.get_session(session_id) if session_id else None
+
+        if path in ("/jsxsd/", "/jsxsd"):
+            new_id = None
+            if session is None:
+                new_id = registrar.new_session()
+            self._send(200, LOGIN_PAGE.format(error=""), cookie=new_id)
+        elif path == "/jsxsd/verifycode.servlet":
+            if session is None:
+                session_id = registrar.new_session()
+                session = registrar.get_session(session_id)
+                cookie = session_id
+            else:
+                cookie = None
+            self._send(200, _captcha_image(registrar.new_captcha(session)), "image/jpeg", cookie=cookie)
+        elif path == "/jsxsd/kscj/cjcx_list":
+            if session is None or session.account is None:
+                registrar.count("expired_responses")
+                self._send(200, LOGIN_PAGE.format(error=""))
+            else:
+                self._send(200, registrar.score_page(session.account))
+        elif path == "/jsxsd/framework/xsMain.jsp":
+            if session is None or session.account is None:
+                registrar.count("expired_responses")
+                self._send(200, LOGIN_PAGE.format(error=""))
+            else:
+                self._send(200, MAIN_PAGE.format(account=session.account))
+        else:
+            self._send(404, "<html><body>Not Found</body></html>")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        registrar = self.registrar
+        registrar.count(f"POST {path}")
+
+        if path == "/robot/send":
+            # 钉钉机器人不受教务系统延迟和出错率影响
+            registrar.count("robot_messages")
+            self._send(200, json.dumps({"errcode": 0, "errmsg": "ok"}), "application/json")
+            return
+
+        if self._delay():
+            return
+
+        if path == "/jsxsd/xk/LoginToXkLdap":
+            session_id = self._session_id()
+            session = registrar.get_session(session_id) if session_id else None
+            if session is None:
+                self._send(200, LOGIN_PAGE.format(error="验证码错误!!"))
+                return
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            error = registrar.login(session, form.get("RANDOMCODE", ""), form.get("encoded", ""))
+            if error:
+                registrar.count("login_failures")
+                self._send(200, LOGIN_PAGE.format(error=error) if "验证码" in error else error)
+            else:
+                registrar.count("logins")
+                self._send(200, MAIN_PAGE.format(account=session.account))
+        else:
+            self._send(404, "<html><body>Not Found</body></html>")
+
+
+def make_server(host="127.0.0.1", port=0, config=None, seed=0):
+    """
+    创建模拟服务器（未启动）
+
+    port 为 0 时使用随机端口，实际地址见 server.server_address。
+    返回: (server, registrar)
+    """
+    registrar = Registrar(config, seed)
+    handler = type("Handler", (RegistrarHandler,), {"registrar": registrar})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, registrar
+
+
+def start_server(host="127.0.0.1", port=0, config=None, seed=0):
+    """
+    在后台线程中启动模拟服务器
+
+    返回: (server, registrar, base_url)，使用完毕后调用 server.shutdown()
+    """
+    server, registrar = make_server(host, port, config, seed)
+    threading.Thread(target=server.serve_forever, name="registrar-simulator", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, registrar, f"http://{host}:{port}"
+
+
+def add_config_arguments(parser):
+    """添加模拟服务器配置参数（压测脚本共用）"""
+    defaults = SimulatorConfig()
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="平均响应延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="返回 500 的概率")
+    parser.add_argument("--session-ttl", type=float, default=defaults.session_ttl, help="session 空闲过期时间（秒）")
+    parser.add_argument("--courses", type=int, default=defaults.courses, help="每个用户的课程数")
+    parser.add_argument("--new-score-rate", type=float, default=defaults.new_score_rate, help="每次查询出现新成绩的概率")
+    parser.add_argument("--captcha-error-rate", type=float, default=defaults.captcha_error_rate, help="验证码被判定错误的概率")
+    parser.add_argument("--strict-captcha", action="store_true", help="要求验证码与图片内容一致")
+
+
+def config_from_args(args):
+    return SimulatorConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        session_ttl=args.session_ttl,
+        courses=args.courses,
+        new_score_rate=args.new_score_rate,
+        captcha_error_rate=args.captcha_error_rate,
+        strict_captcha=args.strict_captcha,
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="本地教务系统模拟服务器")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8800)
+    add_config_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    server, _ = make_server(args.host, args.port, config_from_args(args))
+    print(f"模拟教务系统已启动: http://{args.host}:{args.port}（在环境变量或 .env 中设置 JWXT_BASE_URL 指向该地址）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
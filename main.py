@@ -1,25 +1,34 @@
+from dotenv import load_dotenv
+
+# 各模块在导入时读取配置（教务系统地址、OCR 进程数等），必须先加载 .env
+load_dotenv()
+
 from PIL import Image
 from io import BytesIO
 import datetime
-from dotenv import load_dotenv
-from utils.session_manager import get_session
-from utils.captcha_ocr import get_ocr_res
+from utils.session_manager import get_session, JWXT_BASE_URL
+from utils.captcha_ocr import get_ocr_res, record_attempt
 from utils.logger import logger
 from config import get_user_config
+from utils.metrics import Counter, Histogram
 import time
 
-load_dotenv()
+LOGIN_DURATION = Histogram("monitor_login_duration_seconds", "模拟登录耗时（含验证码识别和重试）")
+LOGIN_TOTAL = Counter("monitor_logins_total", "模拟登录次数，按结果分类（success/failure/error）")
 
 
-def handle_captcha():
+def handle_captcha(session=None):
     """
     获取并识别验证码（单次尝试）
+    参数:
+        session: 登录使用的 session，默认使用全局 session
     返回: 识别出的验证码字符串，失败返回 None
     """
-    session = get_session()
+    if session is None:
+        session = get_session()
 
     # 验证码请求URL
-    RandCodeUrl = "http://zhjw.qfnu.edu.cn/jsxsd/verifycode.servlet"
+    RandCodeUrl = f"{JWXT_BASE_URL}/jsxsd/verifycode.servlet"
 
     try:
         response = session.get(RandCodeUrl, timeout=10)
@@ -39,12 +48,13 @@ def handle_captcha():
             return None
 
         try:
-            image = Image.open(BytesIO(response.content))
+            Image.open(BytesIO(response.content)).verify()
         except Exception as e:
             logger.warning(f"验证码图片解析失败: {e}")
             return None
 
-        result = get_ocr_res(image)
+        # 传递原始字节，便于交给 OCR 工作进程识别
+        result = get_ocr_res(response.content)
         if not result:
             logger.warning("验证码识别失败")
         return result
@@ -75,20 +85,23 @@ def generate_encoded_string(user_account, user_password):
     return encoded
 
 
-def login(random_code, encoded):
+def login(random_code, encoded, session=None):
     """
     执行登录操作
+    参数:
+        session: 登录使用的 session，默认使用全局 session
     返回: 登录响应结果
     """
 
     # 登录请求URL
-    loginUrl = "http://zhjw.qfnu.edu.cn/jsxsd/xk/LoginToXkLdap"
-    session = get_session()
+    loginUrl = f"{JWXT_BASE_URL}/jsxsd/xk/LoginToXkLdap"
+    if session is None:
+        session = get_session()
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36",
-        "Origin": "http://zhjw.qfnu.edu.cn",
-        "Referer": "http://zhjw.qfnu.edu.cn/",
+        "Origin": JWXT_BASE_URL,
+        "Referer": f"{JWXT_BASE_URL}/",
     }
 
     data = {
@@ -98,17 +111,35 @@ def login(random_code, encoded):
         "encoded": encoded,
     }
 
-    return session.post(loginUrl, headers=headers, data=data, timeout=1000)
+    # 登录与成绩检查共用连接池，请求必须有超时，避免卡住的登录长期占用连接
+    return session.post(loginUrl, headers=headers, data=data, timeout=10)
 
 
-def simulate_login(user_account, user_password):
+def simulate_login(user_account, user_password, session=None):
     """
     模拟登录过程
+    参数:
+        session: 登录使用的 session，默认使用全局 session。
+            并发登录时每个登录应传入独立的 session（见 session_manager.new_login_session）
     返回: 是否登录成功
     """
-    session = get_session()
+    started = time.monotonic()
+    result = "error"
+    try:
+        ok = _simulate_login(user_account, user_password, session)
+        result = "success" if ok else "failure"
+        return ok
+    finally:
+        LOGIN_DURATION.observe(time.monotonic() - started)
+        LOGIN_TOTAL.inc(result=result)
+
+
+def _simulate_login(user_account, user_password, session):
+    """simulate_login 的实现"""
+    if session is None:
+        session = get_session()
     # 访问教务系统首页，获取必要的cookie
-    response = session.get("http://zhjw.qfnu.edu.cn/jsxsd/")
+    response = session.get(f"{JWXT_BASE_URL}/jsxsd/", timeout=10)
     if response.status_code != 200:
         logger.error("无法访问教务系统首页，请检查网络连接或教务系统的可用性。")
         return False
@@ -117,17 +148,19 @@ def simulate_login(user_account, user_password):
     cookies = session.cookies
 
     for attempt in range(3):
-        random_code = handle_captcha()
+        random_code = handle_captcha(session)
         if not random_code:
             logger.warning(f"验证码获取失败，重试第 {attempt + 1} 次")
             continue
 
         encoded = generate_encoded_string(user_account, user_password)
-        response = login(random_code, encoded)
+        response = login(random_code, encoded, session)
         logger.info(f"登录响应: {response.status_code}")
 
         if response.status_code == 200:
-            if "验证码错误" in response.text:
+            captcha_ok = "验证码错误" not in response.text
+            record_attempt(captcha_ok)
+            if not captcha_ok:
                 logger.warning(f"验证码识别错误，重试第 {attempt + 1} 次")
                 continue
             if "用户登录" in response.text:
@@ -175,9 +208,7 @@ def main():
 
             # 访问主页
             try:
-                response = session.get(
-                    "http://zhjw.qfnu.edu.cn/jsxsd/framework/xsMain.jsp"
-                )
+                response = session.get(f"{JWXT_BASE_URL}/jsxsd/framework/xsMain.jsp")
                 logger.debug(f"页面响应状态码: {response.status_code}")
                 if response.status_code == 200:
                     logger.info("登录成功!")
@@ -5,6 +5,7 @@ import threading
 from typing import Optional, ClassVar
 from queue import Queue, Empty
 from contextlib import contextmanager
+from utils.metrics import Counter, Gauge
 
 
 def get_timestamp():
@@ -12,27 +13,61 @@ def get_timestamp():
     return int(time.time())
 
 
+class PooledConnection(sqlite3.Connection):
+    """连接池中的连接，记录是否只读、最近归还时间以及是否需要在下次取出时校验"""
+
+    readonly = False
+    released_at = 0.0
+    suspect = False
+
+
 class ConnectionPool:
-    """SQLite 连接池实现"""
+    """
+    SQLite 连接池实现
+
+    与 SQLite 的并发模型保持一致：多个只读连接（PRAGMA query_only）并发读取，
+    写入共用唯一的写连接，进程内的写事务排队执行，不再在数据库锁上忙等。
+    连接只在空闲超过 validate_idle 秒或上次使用出错后才执行 SELECT 1 校验。
+    """
 
-    def __init__(self, db_path, max_connections=5, timeout=30.0):
+    def __init__(self, db_path, max_connections=5, timeout=30.0, validate_idle=60.0):
         self.db_path = db_path
-        self.max_connections = max_connections
+        self.max_connections = max_connections  # 只读连接数上限
         self.timeout = timeout
+        self.validate_idle = validate_idle
         self._pool = Queue(maxsize=max_connections)
         self._lock = threading.Lock()
         self._created_connections = 0
         self._initialized = False
 
-    def _create_connection(self):
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._writer_owner = None
+
+        # 统计
+        self._stats = {
+            "checkouts": 0,  # 取出连接次数
+            "in_use": 0,  # 正在使用的连接数
+            "wait_total": 0.0,  # 等待连接的总时长（秒）
+            "wait_max": 0.0,  # 等待连接的最长时长（秒）
+            "timeouts": 0,  # 等待连接超时次数
+            "validations": 0,  # 执行 SELECT 1 校验的次数
+            "discarded": 0,  # 因失效被丢弃的连接数
+        }
+
+    def _create_connection(self, readonly=False):
         """创建新的数据库连接"""
         conn = sqlite3.connect(
             self.db_path,
             timeout=self.timeout,
             check_same_thread=False,  # 允许多线程使用
             isolation_level=None,  # 自动提交模式，手动控制事务
+            factory=PooledConnection,
+            cached_statements=256,  # 预编译语句缓存，足够容纳 STATEMENTS 中的全部语句
+
         )
         conn.row_factory = sqlite3.Row
+        conn.readonly = readonly
 
         # 启用 WAL 模式和其他优化
         conn.execute("PRAGMA journal_mode=WAL")
@@ -40,60 +75,148 @@ class ConnectionPool:
         conn.execute("PRAGMA cache_size=-64000")  # 64MB 缓存
         conn.execute("PRAGMA temp_store=MEMORY")  # 临时表存储在内存
         conn.execute("PRAGMA busy_timeout=30000")  # 30秒忙等待超时
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
 
         return conn
 
-    def get_connection(self):
-        """从连接池获取连接"""
+    def _is_valid(self, conn):
+        """按需校验连接：空闲过久或上次使用出错时执行 SELECT 1"""
+        if not conn.suspect and time.monotonic() - conn.released_at < self.validate_idle:
+            return True
+        with self._lock:
+            self._stats["validations"] += 1
+        try:
+            conn.execute("SELECT 1")
+            conn.suspect = False
+            return True
+        except sqlite3.Error:
+            self._discard(conn)
+            return False
+
+    def _discard(self, conn):
+        """关闭失效的连接"""
+        with self._lock:
+            self._stats["discarded"] += 1
+            if not conn.readonly:
+                self._writer = None
+            else:
+                self._created_connections -= 1
         try:
-            conn = self._pool.get_nowait()
-            # 检查连接是否有效
+            conn.close()
+        except Exception:
+            pass
+
+    def _record_checkout(self, started):
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_total"] += waited
+            self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+
+    def _timeout(self, message):
+        with self._lock:
+            self._stats["timeouts"] += 1
+        return sqlite3.OperationalError(message)
+
+    def get_connection(self, readonly=False):
+        """
+        从连接池获取连接
+
+        参数:
+            readonly: 是否获取只读连接；否则获取唯一的写连接（同一时刻只有一个线程持有）
+        """
+        started = time.monotonic()
+        conn = self._get_reader(started) if readonly else self._get_writer(started)
+        self._record_checkout(started)
+        return conn
+
+    def _get_writer(self, started):
+        """获取写连接"""
+        if self._writer_owner == threading.get_ident():
+            # 写连接不可重入，同一线程嵌套写事务会永远等待自己
+            raise RuntimeError("当前线程已持有写连接，不能嵌套开启写事务")
+        if not self._writer_lock.acquire(timeout=self.timeout):
+            raise self._timeout("连接池超时：无法获取数据库写连接")
+        try:
+            if self._writer is None or not self._is_valid(self._writer):
+                self._writer = self._create_connection()
+        except Exception:
+            self._writer_lock.release()
+            raise
+        self._writer_owner = threading.get_ident()
+        return self._writer
+
+    def _get_reader(self, started):
+        """获取只读连接"""
+        while True:
             try:
-                conn.execute("SELECT 1")
+                conn = self._pool.get_nowait()
+            except Empty:
+                conn = self._get_or_create_connection(started)
+            if self._is_valid(conn):
                 return conn
-            except sqlite3.Error:
-                # 连接无效，创建新连接
-                with self._lock:
-                    self._created_connections -= 1
-                return self._get_or_create_connection()
-        except Empty:
-            return self._get_or_create_connection()
 
-    def _get_or_create_connection(self):
-        """获取或创建新连接"""
+    def _get_or_create_connection(self, started):
+        """获取或创建新的只读连接"""
         with self._lock:
             if self._created_connections < self.max_connections:
                 self._created_connections += 1
-                return self._create_connection()
-
-        # 已达最大连接数，等待可用连接
-        try:
-            conn = self._pool.get(timeout=self.timeout)
+                create = True
+            else:
+                create = False
+        if create:
             try:
-                conn.execute("SELECT 1")
-                return conn
-            except sqlite3.Error:
+                return self._create_connection(readonly=True)
+            except Exception:
                 with self._lock:
                     self._created_connections -= 1
-                return self._get_or_create_connection()
+                raise
+
+        # 已达最大连接数，等待可用连接
+        remaining = self.timeout - (time.monotonic() - started)
+        try:
+            return self._pool.get(timeout=max(remaining, 0))
         except Empty:
-            raise sqlite3.OperationalError("连接池超时：无法获取数据库连接")
+            raise self._timeout("连接池超时：无法获取数据库连接")
 
-    def release_connection(self, conn):
-        """归还连接到连接池"""
-        if conn:
-            try:
-                # 重置连接状态
+    def release_connection(self, conn, error=False):
+        """
+        归还连接到连接池
+
+        参数:
+            error: 使用过程中是否出错，出错的连接在下次取出时先校验
+        """
+        if not conn:
+            return
+        with self._lock:
+            self._stats["in_use"] -= 1
+        try:
+            # 仅在仍处于事务中时回滚，正常提交的连接无需额外往返
+            if conn.in_transaction:
                 conn.rollback()
+            conn.suspect = conn.suspect or error
+            conn.released_at = time.monotonic()
+            if conn.readonly:
                 self._pool.put_nowait(conn)
-            except Exception:
-                # 如果归还失败，关闭连接
-                with self._lock:
-                    self._created_connections -= 1
-                try:
-                    conn.close()
-                except Exception:
-                    pass
+        except Exception:
+            # 如果归还失败，关闭连接
+            self._discard(conn)
+        finally:
+            if not conn.readonly:
+                self._writer_owner = None
+                self._writer_lock.release()
+
+    def stats(self):
+        """获取连接池统计：取出次数、使用中连接数、等待时长、超时次数等"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["readers"] = self._created_connections
+        stats["wait_avg"] = round(stats["wait_total"] / stats["checkouts"], 6) if stats["checkouts"] else 0.0
+        stats["wait_total"] = round(stats["wait_total"], 6)
+        stats["wait_max"] = round(stats["wait_max"], 6)
+        return stats
 
     def close_all(self):
         """关闭所有连接"""
@@ -106,6 +229,13 @@ class ConnectionPool:
                     pass
             except Empty:
                 break
+        with self._writer_lock:
+            if self._writer is not None:
+                try:
+                    self._writer.close()
+                except Exception:
+                    pass
+                self._writer = None
         with self._lock:
             self._created_connections = 0
 
@@ -130,8 +260,13 @@ class DatabaseManager:
             "dingtalk_secret": "TEXT",
             "enabled": "INTEGER DEFAULT 1",
             "session_expired": "INTEGER DEFAULT 0",
+            "session_expired_at": "INTEGER",
+            "last_active_at": "INTEGER",
+            "session_lifetime": "INTEGER",
             "push_count": "INTEGER DEFAULT 0",
             "last_check_at": "INTEGER",
+            "next_check_at": "INTEGER",
+            "check_interval": "INTEGER",
             "created_at": "INTEGER",
             "updated_at": "INTEGER",
         },
@@ -139,20 +274,83 @@ class DatabaseManager:
             "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
             "user_account": "TEXT NOT NULL",
             "page_hash": "TEXT NOT NULL",
+            "table_hash": "TEXT",
             "reported_course_ids": 'TEXT DEFAULT "[]"',
             "updated_at": "INTEGER",
         },
+        "score_records": {
+            "user_account": "TEXT NOT NULL",
+            "course_id": "TEXT NOT NULL",
+            "term": "TEXT NOT NULL DEFAULT ''",
+            # 考试性质和补重学期：同一课程的正常考试与补考、重修是不同的成绩行
+            "exam_type": "TEXT NOT NULL DEFAULT ''",
+            "retake_term": "TEXT NOT NULL DEFAULT ''",
+            "grade": "TEXT",
+            "gpa": "TEXT",
+            "first_seen_at": "INTEGER",
+            "updated_at": "INTEGER",
+        },
+        "outbox": {
+            "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+            "user_account": "TEXT",
+            "webhook_url": "TEXT NOT NULL",
+            "secret": "TEXT",
+            "payload": "TEXT NOT NULL",
+            "status": "TEXT DEFAULT 'pending'",
+            "attempts": "INTEGER DEFAULT 0",
+            "next_attempt_at": "INTEGER",
+            "last_error": "TEXT",
+            "created_at": "INTEGER",
+            "claimed_by": "TEXT",
+            "claimed_until": "INTEGER",
+        },
+        # 多节点部署：每个用户由持有租约的节点检查
+        "user_leases": {
+            "user_account": "TEXT PRIMARY KEY",
+            "owner": "TEXT NOT NULL",
+            "lease_expires_at": "INTEGER NOT NULL",
+        },
+        "monitor_nodes": {
+            "node_id": "TEXT PRIMARY KEY",
+            "expires_at": "INTEGER NOT NULL",
+        },
     }
 
-    def __init__(self):
+    # 定义索引: 索引名 -> (表名, 列, 是否唯一)
+    INDEXES = {
+        # 检查时按用户取最新的成绩指纹
+        "idx_scores_user": ("scores", "user_account, updated_at", False),
+        "idx_score_records_course": ("score_records", "user_account, course_id, term, exam_type, retake_term", True),
+        "idx_outbox_pending": ("outbox", "status, next_attempt_at", False),
+        "idx_users_next_check": ("users", "next_check_at", False),
+        "idx_user_leases_owner": ("user_leases", "owner, lease_expires_at", False),
+    }
+
+    # 数据迁移，按顺序执行一次，已执行的版本号记录在 PRAGMA user_version
+    MIGRATIONS = [
+        # 1: page_hash 由整页哈希改为成绩行的规范化指纹（score_fingerprint）。
+        # 旧哈希无法离线换算，清空后由下一次检查重新计算；
+        # 由于 reported_course_ids 保留，重新计算不会重复推送已播报的课程。
+        "UPDATE scores SET page_hash = '', table_hash = NULL",
+    ]
+
+    def __init__(self, readonly=False):
+        """
+        Args:
+            readonly: 是否只读。只读事务使用只读连接并发执行；
+                其余事务使用唯一的写连接排队执行，并以 BEGIN IMMEDIATE 开启，
+                先读后写时不会因读锁无法升级为写锁而抛出 database is locked
+        """
         self.conn = None
-        self._ensure_db_exists()
-        self._ensure_pool()
-        self._ensure_migrated()
+        self.readonly = readonly
+        # 连接池创建和迁移只在首次使用时执行，之后实例化不做任何检查
+        if not DatabaseManager._migrated:
+            self._ensure_migrated()
 
-    def _ensure_db_exists(self):
+    @classmethod
+    def _ensure_db_exists(cls):
         """确保数据库文件和目录存在"""
-        db_dir = os.path.dirname(self.DB_PATH)
+        db_dir = os.path.dirname(cls.DB_PATH)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir)
 
@@ -162,6 +360,7 @@ class DatabaseManager:
         if cls._pool is None:
             with cls._pool_lock:
                 if cls._pool is None:
+                    cls._ensure_db_exists()
                     cls._pool = ConnectionPool(
                         cls.DB_PATH, max_connections=5, timeout=30.0
                     )
@@ -181,7 +380,7 @@ class DatabaseManager:
             conn = cls._pool.get_connection()
             try:
                 cursor = conn.cursor()
-                conn.execute("BEGIN")
+                conn.execute("BEGIN IMMEDIATE")
 
                 for table_name, columns in cls.SCHEMA.items():
                     # 检查表是否存在
@@ -206,6 +405,17 @@ class DatabaseManager:
                                     f"ALTER TABLE {table_name} ADD COLUMN {col} {dtype}"
                                 )
 
+                for index_name, (table_name, columns, unique) in cls.INDEXES.items():
+                    cursor.execute(
+                        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})"
+                    )
+
+                # 执行尚未执行过的数据迁移
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                for sql in cls.MIGRATIONS[version:]:
+                    cursor.execute(sql)
+                cursor.execute(f"PRAGMA user_version = {len(cls.MIGRATIONS)}")
+
                 conn.execute("COMMIT")
                 cls._migrated = True
             except Exception:
@@ -219,8 +429,13 @@ class DatabaseManager:
         """进入上下文管理器，从连接池获取连接"""
         self._ensure_pool()
         assert self._pool is not None  # 类型断言
-        self.conn = self._pool.get_connection()
-        self.conn.execute("BEGIN")
+        self.conn = self._pool.get_connection(readonly=self.readonly)
+        try:
+            self.conn.execute("BEGIN" if self.readonly else "BEGIN IMMEDIATE")
+        except Exception:
+            self._pool.release_connection(self.conn, error=True)
+            self.conn = None
+            raise
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -229,20 +444,23 @@ class DatabaseManager:
             try:
                 if exc_type is None:
                     self.conn.execute("COMMIT")
-                else:
+                elif self.conn.in_transaction:
                     self.conn.execute("ROLLBACK")
             finally:
                 assert self._pool is not None  # 类型断言
-                self._pool.release_connection(self.conn)
+                self._pool.release_connection(
+                    self.conn,
+                    error=exc_type is not None and issubclass(exc_type, sqlite3.Error),
+                )
                 self.conn = None
         return False
 
     @classmethod
-    def get_connection(cls):
+    def get_connection(cls, readonly=False):
         """直接获取连接（需要手动释放）"""
         cls._ensure_pool()
         assert cls._pool is not None  # 类型断言
-        return cls._pool.get_connection()
+        return cls._pool.get_connection(readonly=readonly)
 
     @classmethod
     def release_connection(cls, conn):
@@ -252,20 +470,30 @@ class DatabaseManager:
 
     @classmethod
     @contextmanager
-    def connection(cls):
+    def connection(cls, readonly=False):
         """获取连接的上下文管理器（推荐使用）"""
         cls._ensure_pool()
         assert cls._pool is not None  # 类型断言
-        conn = cls._pool.get_connection()
+        conn = cls._pool.get_connection(readonly=readonly)
+        error = False
         try:
-            conn.execute("BEGIN")
+            conn.execute("BEGIN" if readonly else "BEGIN IMMEDIATE")
             yield conn
             conn.execute("COMMIT")
-        except Exception:
-            conn.execute("ROLLBACK")
+        except Exception as e:
+            error = isinstance(e, sqlite3.Error)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
             raise
         finally:
-            cls._pool.release_connection(conn)
+            cls._pool.release_connection(conn, error=error)
+
+    @classmethod
+    def pool_stats(cls):
+        """获取连接池统计信息"""
+        if cls._pool is None:
+            return {}
+        return cls._pool.stats()
 
     @classmethod
     def close_pool(cls):
@@ -277,6 +505,233 @@ class DatabaseManager:
                 cls._migrated = False
 
 
+# 成绩检查需要的用户字段中，凭据和钉钉配置只在导入时变化，缓存在 UserRoster 中；
+# 其余字段每次检查都会变化，每次从数据库读取
+USER_STATE_SELECT = (
+    "SELECT user_account, updated_at, encrypted_session, session_expired_at, check_interval, "
+    "last_active_at, session_lifetime, "
+    "(SELECT table_hash FROM scores WHERE scores.user_account = users.user_account ORDER BY updated_at DESC LIMIT 1) AS table_hash "
+    "FROM users"
+)
+ACTIVE_USERS = "enabled = 1 AND session_expired = 0"
+
+# 命名语句，各模块按名称复用。固定的 SQL 文本可以命中 sqlite3 的预编译语句缓存
+STATEMENTS = {
+    "user_roster": "SELECT user_account, updated_at, encrypted_password, encryption_key, dingtalk_webhook, dingtalk_secret FROM users",
+    "user_state": f"{USER_STATE_SELECT} WHERE user_account = ?",
+    "active_users": f"{USER_STATE_SELECT} WHERE {ACTIVE_USERS}",
+    "due_users": f"{USER_STATE_SELECT} WHERE {ACTIVE_USERS} AND (next_check_at IS NULL OR next_check_at <= ?)",
+    "idle_users": (
+        f"{USER_STATE_SELECT} WHERE {ACTIVE_USERS} AND last_active_at IS NOT NULL "
+        "AND ? >= last_active_at + COALESCE(session_lifetime, ?) * ? "
+        "AND (next_check_at IS NULL OR next_check_at > ?)"
+    ),
+    "list_users": "SELECT user_account, enabled, session_expired, push_count, last_check_at, created_at, updated_at FROM users",
+    "count_users": (
+        "SELECT COUNT(*) AS total, "
+        "COALESCE(SUM(enabled = 1 AND session_expired = 0), 0) AS enabled, "
+        "COALESCE(SUM(session_expired = 1), 0) AS expired, "
+        "COALESCE(SUM(enabled = 0), 0) AS disabled, "
+        "COALESCE(SUM(push_count), 0) AS push_count "
+        "FROM users"
+    ),
+    "upsert_user": (
+        "INSERT OR REPLACE INTO users (user_account, encrypted_password, encrypted_session, encryption_key, dingtalk_webhook, dingtalk_secret, "
+        "enabled, session_expired, session_expired_at, last_active_at, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, 1, 0, NULL, ?, ?, ?)"
+    ),
+    "delete_user": "DELETE FROM users WHERE user_account = ?",
+    "delete_user_scores": "DELETE FROM scores WHERE user_account = ?",
+    "delete_user_score_records": "DELETE FROM score_records WHERE user_account = ?",
+    "toggle_user": "UPDATE users SET enabled = 1 - enabled WHERE user_account = ?",
+    "mark_session_expired": "UPDATE users SET session_expired = 1 WHERE user_account = ?",
+    "mark_session_expired_at": "UPDATE users SET session_expired_at = ? WHERE user_account = ?",
+    "mark_session_expired_at_lifetime": "UPDATE users SET session_expired_at = ?, session_lifetime = ? WHERE user_account = ?",
+    "replace_session": (
+        "UPDATE users SET encrypted_session = ?, session_expired = 0, session_expired_at = NULL, last_active_at = ? "
+        "WHERE user_account = ?"
+    ),
+    "write_back_session": "UPDATE users SET encrypted_session = ? WHERE user_account = ? AND encrypted_session = ?",
+    "update_schedule": (
+        "UPDATE users SET last_check_at = ?, check_interval = ?, next_check_at = ?, last_active_at = ?, session_lifetime = ? "
+        "WHERE user_account = ?"
+    ),
+    "update_activity": "UPDATE users SET last_active_at = ?, session_lifetime = ? WHERE user_account = ?",
+    "add_push_count": "UPDATE users SET push_count = push_count + ? WHERE user_account = ?",
+    "count_active_users": f"SELECT COUNT(*) FROM users WHERE {ACTIVE_USERS}",
+    "heartbeat_node": "INSERT OR REPLACE INTO monitor_nodes (node_id, expires_at) VALUES (?, ?)",
+    "prune_nodes": "DELETE FROM monitor_nodes WHERE expires_at <= ?",
+    "count_live_nodes": "SELECT COUNT(*) FROM monitor_nodes WHERE expires_at > ?",
+    "renew_leases": "UPDATE user_leases SET lease_expires_at = ? WHERE owner = ?",
+    "drop_inactive_leases": (
+        f"DELETE FROM user_leases WHERE owner = ? AND user_account NOT IN (SELECT user_account FROM users WHERE {ACTIVE_USERS})"
+    ),
+    "owned_leases": "SELECT user_account FROM user_leases WHERE owner = ? AND lease_expires_at > ? ORDER BY user_account",
+    "claim_leases": (
+        "INSERT INTO user_leases (user_account, owner, lease_expires_at) "
+        "SELECT users.user_account, ?, ? FROM users LEFT JOIN user_leases ON user_leases.user_account = users.user_account "
+        f"WHERE {ACTIVE_USERS} AND (user_leases.user_account IS NULL OR user_leases.lease_expires_at <= ?) "
+        "ORDER BY users.user_account LIMIT ? "
+        "ON CONFLICT(user_account) DO UPDATE SET owner = excluded.owner, lease_expires_at = excluded.lease_expires_at"
+    ),
+    "release_lease": "DELETE FROM user_leases WHERE user_account = ? AND owner = ?",
+    "delete_user_lease": "DELETE FROM user_leases WHERE user_account = ?",
+}
+
+
+class UserRow:
+    """
+    成绩检查使用的用户信息
+
+    由数据库中的状态字段和 UserRoster 中缓存的凭据合并而成，既可 row.user_account
+    也可 row["user_account"] 访问，与 sqlite3.Row 的用法一致。
+    """
+
+    __slots__ = (
+        "user_account",
+        "updated_at",
+        "encrypted_session",
+        "session_expired_at",
+        "check_interval",
+        "last_active_at",
+        "session_lifetime",
+        "table_hash",
+        "encrypted_password",
+        "encryption_key",
+        "dingtalk_webhook",
+        "dingtalk_secret",
+    )
+
+    def __init__(self, values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"UserRow({self.user_account!r})"
+
+
+class UserRoster:
+    """
+    用户凭据和钉钉配置的缓存（线程安全）
+
+    导入、启停、删除用户时应调用 invalidate()；其他进程导入的用户通过 updated_at 识别，
+    发现缓存中缺少或版本不一致的用户时自动重新加载。
+    """
+
+    def __init__(self):
+        self._entries = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _load(self, conn):
+        with self._lock:
+            version = self._version
+        entries = {
+            row[0]: (row[1], tuple(row)[2:])
+            for row in conn.execute(STATEMENTS["user_roster"])
+        }
+        with self._lock:
+            # 加载期间缓存被置为失效时不保存本次结果
+            if version == self._version:
+                self._entries = entries
+        return entries
+
+    def users(self, conn, name, params=()):
+        """
+        执行命名的用户状态查询，返回 UserRow 列表
+
+        参数:
+            conn: 数据库连接（只读连接即可）
+            name: STATEMENTS 中以 USER_STATE_SELECT 开头的语句名
+        """
+        rows = conn.execute(STATEMENTS[name], params).fetchall()
+        entries = self._entries
+        if entries is None or any(
+            row[0] not in entries or entries[row[0]][0] != row[1] for row in rows
+        ):
+            entries = self._load(conn)
+
+        users = []
+        for row in rows:
+            entry = entries.get(row[0])
+            if entry is not None:
+                users.append(UserRow(tuple(row) + entry[1]))
+        return users
+
+    def invalidate(self):
+        """使缓存失效"""
+        with self._lock:
+            self._entries = None
+            self._version += 1
+
+
+user_roster = UserRoster()
+
+
+class WriteBatcher:
+    """
+    批量写入器（线程安全）
+
+    按 SQL 语句收集参数，flush() 时在一个短事务中对每条语句执行一次 executemany，
+    将一轮检查中大量的单行 UPDATE 合并为少量批量写入，缩短写锁的持有时间。
+    """
+
+    def __init__(self, flush_size=100):
+        self.flush_size = flush_size
+        self._statements = {}
+        self._callbacks = []
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def add(self, sql, params, on_flush=None):
+        """
+        加入一条待写入的语句
+
+        参数:
+            on_flush: 可选，写入提交后调用的回调
+        返回: 待写入条数是否已达到 flush_size
+        """
+        with self._lock:
+            self._statements.setdefault(sql, []).append(params)
+            if on_flush is not None:
+                self._callbacks.append(on_flush)
+            self._size += 1
+            return self._size >= self.flush_size
+
+    def flush(self):
+        """写入全部待写入的语句（按语句首次加入的顺序），返回写入条数"""
+        with self._lock:
+            statements, callbacks, size = self._statements, self._callbacks, self._size
+            self._statements, self._callbacks, self._size = {}, [], 0
+        if not size:
+            return 0
+
+        with DatabaseManager() as conn:
+            for sql, params in statements.items():
+                conn.executemany(sql, params)
+        for callback in callbacks:
+            callback()
+        return size
+
+    def __len__(self):
+        return self._size
+
+
+def _pool_stat(name):
+    return lambda: DatabaseManager.pool_stats().get(name, 0)
+
+
+DB_POOL_IN_USE = Gauge("monitor_db_pool_in_use", "正在使用的数据库连接数", func=_pool_stat("in_use"))
+DB_POOL_READERS = Gauge("monitor_db_pool_readers", "已创建的只读连接数", func=_pool_stat("readers"))
+DB_POOL_CHECKOUTS = Counter("monitor_db_pool_checkouts_total", "取出数据库连接的次数", func=_pool_stat("checkouts"))
+DB_POOL_WAIT = Counter("monitor_db_pool_wait_seconds_total", "等待数据库连接的总时长", func=_pool_stat("wait_total"))
+DB_POOL_WAIT_MAX = Gauge("monitor_db_pool_wait_max_seconds", "等待数据库连接的最长时长", func=_pool_stat("wait_max"))
+DB_POOL_TIMEOUTS = Counter("monitor_db_pool_timeouts_total", "等待数据库连接超时的次数", func=_pool_stat("timeouts"))
+
+
 # 初始化数据库
 def init_db():
     """初始化数据库（兼容旧代码）"""
@@ -1,18 +1,92 @@
+import os
+import math
+import time
+import zlib
+import random
+import datetime
+import itertools
+import threading
+import multiprocessing
+from queue import PriorityQueue
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from apscheduler.schedulers.background import BackgroundScheduler
-from models import DatabaseManager, get_timestamp
-from utils.score_monitor import restore_session, fetch_scores, compare_scores, serialize_session
-from utils.dingtalk import notify_new_scores, notify_session_expired
+from models import DatabaseManager, WriteBatcher, STATEMENTS, user_roster, get_timestamp
+from utils.score_monitor import fetch_scores, compare_scores, serialize_session, check_session_expired
+from utils.session_cache import session_cache, get_user_session
+from utils.session_manager import JWXT_BASE_URL
+from utils.leases import claim_leases
+from utils.dingtalk import notify_new_scores, notify_session_expired, start_dispatcher, stop_dispatcher
 from utils.crypto import encrypt_session, decrypt_session
 from utils.logger import logger
+from utils.metrics import Counter, Gauge, Histogram
 scheduler = BackgroundScheduler()
 
 MAX_LOGIN_ATTEMPTS = 3  # 验证码识别最大尝试次数
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", 8))  # 并发检查的线程数
+SWEEP_DEADLINE = int(os.getenv("SWEEP_DEADLINE", 240))  # 单轮检查的最长耗时（秒）
+RELOGIN_WORKERS = int(os.getenv("RELOGIN_WORKERS", 4))  # 并行重新登录的线程数
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))  # 检查结果累计多少条后批量写入数据库
+# 分片检查的工作进程数，0 或 1 表示在当前进程内检查；每个进程内仍使用 SWEEP_WORKERS 个线程
+SWEEP_PROCESSES = int(os.getenv("SWEEP_PROCESSES", 0))
+SHARD_GRACE = 30  # 等待分片进程结果时在 SWEEP_DEADLINE 之外多等待的时间（秒）
+
+# 自适应检查间隔：发现新成绩或处于考试周时使用最短间隔，无变化时逐次翻倍直到最长间隔
+CHECK_INTERVAL_MIN = int(os.getenv("CHECK_INTERVAL_MIN", 300))  # 最短检查间隔（秒）
+CHECK_INTERVAL_MAX = int(os.getenv("CHECK_INTERVAL_MAX", 7200))  # 最长检查间隔（秒）
+CHECK_JITTER = 0.2  # 检查时间随机抖动比例，避免所有用户同时到期
+SCHEDULER_TICK = int(os.getenv("SCHEDULER_TICK", 60))  # 扫描到期用户的间隔（秒）
+# 考试周（出成绩高峰），格式: 月-日~月-日，多个用逗号分隔
+EXAM_WINDOWS = os.getenv("EXAM_WINDOWS", "01-01~02-10,06-15~07-31")
+
+# Session 保活：在预计过期前访问一次轻量页面，并根据观察结果学习每个用户的 session 寿命
+KEEPALIVE_URL = f"{JWXT_BASE_URL}/jsxsd/framework/xsMain.jsp"
+KEEPALIVE_TICK = int(os.getenv("KEEPALIVE_TICK", 60))  # 扫描需要保活用户的间隔（秒）
+KEEPALIVE_MARGIN = 0.7  # 空闲时间达到预计寿命的该比例时保活
+KEEPALIVE_WORKERS = 4
+SESSION_LIFETIME_DEFAULT = int(os.getenv("SESSION_LIFETIME_DEFAULT", 1800))  # 初始预计寿命（秒）
+SESSION_LIFETIME_MIN = 300
+SESSION_LIFETIME_MAX = 86400
+# 寿命探测：保活总在预计寿命之前进行，估计值只会变小。每 KEEPALIVE_PROBE_EVERY 个空闲期中约有一个
+# 推迟到预计寿命的 KEEPALIVE_PROBE_FACTOR 倍再保活，仍有效则调大估计值；已过期则立即重新登录。
+# 只在低峰时段（KEEPALIVE_PROBE_HOURS，本地时间 起始时-结束时）探测，探测失败引起的重新登录不会落在白天的检查高峰
+KEEPALIVE_PROBE_EVERY = int(os.getenv("KEEPALIVE_PROBE_EVERY", 10))
+KEEPALIVE_PROBE_FACTOR = 1.25
+KEEPALIVE_PROBE_HOURS = os.getenv("KEEPALIVE_PROBE_HOURS", "1-6")
+
+SWEEP_DURATION = Histogram("monitor_sweep_duration_seconds", "单轮检查总耗时")
+SWEEP_USERS = Counter("monitor_sweep_users_total", "各轮检查的用户数，按结果分类（checked/failed/timed_out/skipped）")
+SWEEP_LAST_DURATION = Gauge("monitor_sweep_last_duration_seconds", "最近一轮检查的总耗时")
+SWEEP_LAST_FINISHED = Gauge("monitor_sweep_last_finished_timestamp", "最近一轮检查的完成时间")
+SWEEP_DEADLINE_SECONDS = Gauge("monitor_sweep_deadline_seconds", "单轮检查的最长耗时（SWEEP_DEADLINE）", func=lambda: SWEEP_DEADLINE)
+CHECK_DURATION = Histogram("monitor_user_check_duration_seconds", "单个用户检查耗时，按检查结果分类")
+RELOGIN_TOTAL = Counter("monitor_relogins_total", "自动重新登录次数，按结果分类（success/failure）")
+KEEPALIVE_TOTAL = Counter("monitor_keepalive_pings_total", "Session 保活请求次数，按结果分类（alive/expired/error）")
+SESSION_CACHE_HITS = Counter("monitor_session_cache_hits_total", "已解密 session 缓存命中次数", func=lambda: session_cache.hits)
+SESSION_CACHE_MISSES = Counter("monitor_session_cache_misses_total", "已解密 session 缓存未命中次数", func=lambda: session_cache.misses)
+
+# 正在检查中的用户，避免上一轮超时未完成的用户被重复检查
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+# 检查时间、Cookie 等写入每 WRITE_BATCH_SIZE 个用户批量提交一次，每轮结束时提交剩余部分
+_sweep_writes = WriteBatcher(flush_size=WRITE_BATCH_SIZE)
+
+# 最近一轮检查的统计信息
+last_sweep_summary = None
+
+# 分片工作进程，每个分片固定由同一个进程检查，进程内的 session 缓存、数据库连接池和 HTTP 连接池得以复用
+_shard_executors = []
+_shard_lock = threading.Lock()
 
 
 def try_relogin(user_account, encrypted_password, encryption_key):
-    """尝试重新登录，最多尝试3次"""
+    """尝试重新登录，最多尝试3次
+
+    每次尝试使用独立的 session，可与其他用户的登录并行执行。
+    """
     from main import simulate_login
-    from utils.session_manager import get_session, reset_session
+    from utils.session_manager import new_login_session
 
     try:
         # 解密密码
@@ -24,10 +98,9 @@ def try_relogin(user_account, encrypted_password, encryption_key):
     for attempt in range(1, MAX_LOGIN_ATTEMPTS + 1):
         try:
             logger.info(f"用户 {user_account} 尝试重新登录 (第{attempt}次)")
-            reset_session()
+            session = new_login_session()
 
-            if simulate_login(user_account, password):
-                session = get_session()
+            if simulate_login(user_account, password, session):
                 session_data = serialize_session(session)
                 new_encrypted_session = encrypt_session(session_data, encryption_key)
                 logger.info(f"用户 {user_account} 重新登录成功")
@@ -40,8 +113,11 @@ def try_relogin(user_account, encrypted_password, encryption_key):
     return None
 
 
-def handle_expired_session(cursor, user, dingtalk_webhook, dingtalk_secret):
-    """处理过期的 Session，尝试自动重新登录"""
+def handle_expired_session(user, dingtalk_webhook, dingtalk_secret):
+    """处理过期的 Session，尝试自动重新登录
+
+    重新登录涉及网络请求，在事务之外完成，仅在写入结果时短暂开启事务。
+    """
     user_account = user["user_account"]
     encrypted_password = user["encrypted_password"]
     encryption_key = user["encryption_key"]
@@ -49,141 +125,705 @@ def handle_expired_session(cursor, user, dingtalk_webhook, dingtalk_secret):
     # 如果没有存储密码，直接标记过期
     if not encrypted_password:
         logger.warning(f"用户 {user_account} 未存储密码，无法自动重新登录")
-        cursor.execute(
-            "UPDATE users SET session_expired = 1 WHERE user_account = ?",
-            (user_account,),
-        )
+        with DatabaseManager() as conn:
+            conn.execute(STATEMENTS["mark_session_expired"], (user_account,))
         notify_session_expired(dingtalk_webhook, dingtalk_secret, user_account)
         return False
 
     # 尝试重新登录
     new_encrypted_session = try_relogin(user_account, encrypted_password, encryption_key)
 
+    session_cache.invalidate(user_account)
+    RELOGIN_TOTAL.inc(result="success" if new_encrypted_session else "failure")
     if new_encrypted_session:
         # 更新 session（静默重登，不通知用户）
-        cursor.execute(
-            "UPDATE users SET encrypted_session = ?, session_expired = 0 WHERE user_account = ?",
-            (new_encrypted_session, user_account),
-        )
+        with DatabaseManager() as conn:
+            conn.execute(
+                STATEMENTS["replace_session"],
+                (new_encrypted_session, get_timestamp(), user_account),
+            )
         logger.info(f"用户 {user_account} Session 已自动更新")
         return True
     else:
         # 登录失败，标记过期
-        cursor.execute(
-            "UPDATE users SET session_expired = 1 WHERE user_account = ?",
-            (user_account,),
-        )
+        with DatabaseManager() as conn:
+            conn.execute(STATEMENTS["mark_session_expired"], (user_account,))
         notify_session_expired(dingtalk_webhook, dingtalk_secret, user_account)
         return False
 
 
+class ReloginQueue:
+    """并行重新登录队列
+
+    最多 workers 个登录同时进行，每个登录使用独立的 session；
+    按 Session 过期时间排序，过期最久的用户优先登录。同一用户重复提交时返回同一个 Future。
+    """
+
+    def __init__(self, workers=RELOGIN_WORKERS):
+        self.workers = workers
+        self._queue = PriorityQueue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._threads = []
+
+    def submit(self, user, expired_at=None):
+        """
+        提交重新登录任务
+
+        参数:
+            user: users 表中的一行
+            expired_at: Session 过期时间，越早越优先，默认为当前时间
+        返回: Future，结果为 handle_expired_session 的返回值
+        """
+        user_account = user["user_account"]
+        with self._lock:
+            future = self._pending.get(user_account)
+            if future is not None:
+                return future
+            future = Future()
+            self._pending[user_account] = future
+            priority = expired_at if expired_at is not None else get_timestamp()
+            self._queue.put((priority, next(self._counter), user, future))
+            self._ensure_workers()
+        return future
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        for i in range(len(self._threads), self.workers):
+            thread = threading.Thread(target=self._run, name=f"relogin-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            _, _, user, future = self._queue.get()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(
+                        handle_expired_session(user, user["dingtalk_webhook"], user["dingtalk_secret"])
+                    )
+            except Exception as e:
+                logger.error(f"用户 {user['user_account']} 重新登录出错: {str(e)}")
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._pending.pop(user["user_account"], None)
+                self._queue.task_done()
+
+    def pending_count(self):
+        """排队及正在登录的用户数"""
+        with self._lock:
+            return len(self._pending)
+
+
+relogin_queue = ReloginQueue()
+
+
+def _parse_exam_windows(value):
+    """解析考试周配置，返回 [((月, 日), (月, 日))]"""
+    windows = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            start, end = (tuple(int(part) for part in day.strip().split("-")) for day in item.split("~"))
+            windows.append((start, end))
+        except ValueError:
+            logger.warning(f"考试周配置格式错误，已忽略: {item}")
+    return windows
+
+
+_exam_windows = _parse_exam_windows(EXAM_WINDOWS)
+
+
+def in_exam_window(timestamp=None):
+    """判断给定时间是否处于考试周（支持跨年区间，如 12-20~01-10）"""
+    now = datetime.datetime.fromtimestamp(timestamp or get_timestamp())
+    today = (now.month, now.day)
+    for start, end in _exam_windows:
+        if start <= end:
+            if start <= today <= end:
+                return True
+        elif today >= start or today <= end:
+            return True
+    return False
+
+
+def next_check_interval(previous_interval, result, now=None):
+    """
+    计算下一次检查的间隔（秒，未加抖动）
+
+    发现新成绩或刚重新登录时恢复最短间隔；无变化时翻倍退避；
+    检查失败时保持原间隔；考试周内始终使用最短间隔。
+    """
+    if in_exam_window(now):
+        return CHECK_INTERVAL_MIN
+    status = result.get("status")
+    if status in ("new_scores", "relogin") or not previous_interval:
+        return CHECK_INTERVAL_MIN
+    if status == "no_change":
+        return min(previous_interval * 2, CHECK_INTERVAL_MAX)
+    return previous_interval
+
+
+def learn_session_lifetime(user, now, alive):
+    """
+    根据一次观察更新用户 session 寿命的估计（秒）
+
+    alive 为 True 表示空闲这么久后 session 仍有效，寿命至少为空闲时长（探测时会超过原估计值）；
+    为 False 表示 session 已过期，真实寿命不超过空闲时长，估计值向其靠拢。
+    """
+    lifetime = user["session_lifetime"] or SESSION_LIFETIME_DEFAULT
+    if not user["last_active_at"]:
+        return lifetime
+    idle = now - user["last_active_at"]
+    if alive:
+        return min(max(lifetime, idle), SESSION_LIFETIME_MAX)
+    return max(SESSION_LIFETIME_MIN, int(lifetime * 0.5 + min(idle, lifetime) * 0.5))
+
+
+def queue_session_write(writes, user, session):
+    """
+    Cookie 有变化时，将 session 加入批量写回
+
+    仅当数据库中的 session 仍是读取时的版本才会覆盖，避免覆盖并发的重新登录或重新导入。
+    """
+    user_account = user["user_account"]
+    if not session_cache.cookies_changed(user_account, session):
+        return
+    new_encrypted_session = encrypt_session(serialize_session(session), user["encryption_key"])
+    writes.add(
+        STATEMENTS["write_back_session"],
+        (new_encrypted_session, user_account, user["encrypted_session"]),
+        on_flush=lambda: session_cache.mark_persisted(user_account, new_encrypted_session, session),
+    )
+
+
+def flush_writes(writes):
+    """写入批量写入器中的待写入数据，失败时记录日志"""
+    try:
+        count = writes.flush()
+    except Exception as e:
+        logger.error(f"批量写入检查结果失败: {str(e)}")
+        return
+    if count:
+        logger.debug(f"已批量写入 {count} 条检查结果")
+
+
+def check_user(user, writes=None):
+    """检查单个用户的成绩（user 为 users 表中的一行），并安排下一次检查时间
+
+    Args:
+        writes: 可选的 WriteBatcher，检查时间和 Cookie 等写入交由调用方批量提交；
+            为 None 时检查结束后立即写入
+    """
+    batch = WriteBatcher() if writes is None else writes
+    result = _run_check(user, batch)
+
+    now = get_timestamp()
+    interval = next_check_interval(user["check_interval"], result, now)
+    jitter = random.uniform(1 - CHECK_JITTER, 1 + CHECK_JITTER)
+
+    # 学习 session 寿命：成功访问说明 session 仍有效，过期则说明寿命不超过本次空闲时长
+    status = result.get("status")
+    last_active_at = user["last_active_at"]
+    lifetime = user["session_lifetime"]
+    if status in ("no_change", "new_scores"):
+        lifetime = learn_session_lifetime(user, now, alive=True)
+        last_active_at = now
+    elif status in ("relogin", "expired"):
+        lifetime = learn_session_lifetime(user, now, alive=False)
+        if status == "relogin":
+            last_active_at = now
+
+    full = batch.add(
+        STATEMENTS["update_schedule"],
+        (now, interval, now + int(interval * jitter), last_active_at, lifetime, user["user_account"]),
+    )
+    if writes is None or full:
+        flush_writes(batch)
+    return result
+
+
+def _run_check(user, writes):
+    """执行一次成绩检查
+
+    网络请求均在事务之外进行。检查结果由 writes 批量写入；
+    成绩对比和过期标记需要与其他事务保持先后顺序，仍在各自的短事务中立即写入。
+    """
+    user_account = user["user_account"]
+
+    try:
+        session = get_user_session(user_account, user["encrypted_session"], user["encryption_key"])
+        page_hash, scores, expired, table_hash = fetch_scores(session, known_hash=user["table_hash"])
+
+        # 教务系统轮换了 Cookie 时记录下来，写回数据库以延长 session 寿命
+        if not expired:
+            queue_session_write(writes, user, session)
+
+        if expired:
+            logger.warning(f"用户 {user_account} 的session已过期，尝试自动重新登录")
+            session_cache.invalidate(user_account)
+
+            # 记录首次发现过期的时间，作为重新登录的优先级
+            expired_at = user["session_expired_at"] or get_timestamp()
+            with DatabaseManager() as conn:
+                conn.execute(STATEMENTS["mark_session_expired_at"], (expired_at, user_account))
+
+            if relogin_queue.submit(user, expired_at).result():
+                return {"success": True, "message": "Session已过期，已自动重新登录", "status": "relogin"}
+            else:
+                return {"success": True, "message": "Session已过期，自动登录失败，已发送通知", "status": "expired"}
+
+        if table_hash is not None and scores is None:
+            # 表格指纹未变化，跳过解析与对比
+            logger.info(f"用户 {user_account} 无新成绩")
+            return {"success": True, "message": "暂无新成绩", "status": "no_change"}
+
+        if page_hash is not None and scores is not None:
+            new_courses = compare_scores(user_account, page_hash, scores, table_hash=table_hash)
+
+            if new_courses:
+                logger.info(f"用户 {user_account} 发现新成绩: {len(new_courses)}门")
+                notify_new_scores(user["dingtalk_webhook"], user["dingtalk_secret"], new_courses, user_account)
+                return {"success": True, "message": f"发现 {len(new_courses)} 门新成绩，已发送通知", "status": "new_scores", "count": len(new_courses)}
+            else:
+                logger.info(f"用户 {user_account} 无新成绩")
+                return {"success": True, "message": "暂无新成绩", "status": "no_change"}
+
+        return {"success": False, "message": "获取成绩失败"}
+
+    except Exception as e:
+        logger.error(f"检查用户 {user_account} 时出错: {str(e)}")
+        return {"success": False, "message": str(e)}
+
+
 def check_single_user(user_account):
     """检查单个用户的成绩"""
     logger.info(f"开始检查用户 {user_account} 的成绩")
 
-    with DatabaseManager() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT user_account, encrypted_password, encrypted_session, encryption_key, dingtalk_webhook, dingtalk_secret FROM users WHERE user_account = ?",
-            (user_account,),
-        )
-        user = cursor.fetchone()
+    with DatabaseManager(readonly=True) as conn:
+        users = user_roster.users(conn, "user_state", (user_account,))
 
-        if not user:
-            return {"success": False, "message": "用户不存在"}
+    if not users:
+        return {"success": False, "message": "用户不存在"}
 
-        # 更新最近检查时间
-        cursor.execute(
-            "UPDATE users SET last_check_at = ? WHERE user_account = ?",
-            (get_timestamp(), user_account),
-        )
+    return check_user(users[0])
 
-        try:
-            session = restore_session(user["encrypted_session"], user["encryption_key"])
-            page_hash, scores, expired = fetch_scores(session)
 
-            if expired:
-                logger.warning(f"用户 {user_account} 的session已过期，尝试自动重新登录")
+def _percentile(values, pct):
+    """计算百分位数（最近秩法），values 需已排序"""
+    if not values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
 
-                if handle_expired_session(cursor, user, user["dingtalk_webhook"], user["dingtalk_secret"]):
-                    return {"success": True, "message": "Session已过期，已自动重新登录", "status": "relogin"}
-                else:
-                    return {"success": True, "message": "Session已过期，自动登录失败，已发送通知", "status": "expired"}
+def _timed_check(user, writes):
+    """执行单个用户检查并记录耗时，供线程池调用"""
+    started = time.monotonic()
+    try:
+        result = check_user(user, writes)
+    except Exception as e:
+        logger.error(f"检查用户 {user['user_account']} 时出错: {str(e)}")
+        result = {"success": False, "message": str(e)}
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(user["user_account"])
+    elapsed = time.monotonic() - started
+    CHECK_DURATION.observe(elapsed, status=result.get("status", "failed"))
+    return result, elapsed
+
+
+def _check_in_threads(users, progress=None):
+    """
+    在当前进程的线程池中检查一组用户
+
+    返回: ([(检查结果状态, 是否成功, 耗时)], 超时未完成的用户数)
+    """
+    executor = ThreadPoolExecutor(max_workers=SWEEP_WORKERS, thread_name_prefix="sweep")
+    try:
+        futures = [executor.submit(_timed_check, user, _sweep_writes) for user in users]
+        if progress is not None:
+            completed = itertools.count(1)
+            for future in futures:
+                future.add_done_callback(lambda _: progress(next(completed), len(futures)))
+        done, not_done = wait(futures, timeout=SWEEP_DEADLINE)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    # 超时未完成的用户在完成后由后续的批量写入或下一轮结束时提交
+    flush_writes(_sweep_writes)
+
+    outcomes = []
+    for future in done:
+        result, elapsed = future.result()
+        outcomes.append((result.get("status", "failed"), bool(result.get("success")), elapsed))
+
+    # 被取消（从未开始）的任务需要手动移出检查中集合
+    for future, user in zip(futures, users):
+        if future.cancelled():
+            with _in_flight_lock:
+                _in_flight.discard(user["user_account"])
+
+    return outcomes, len(not_done)
+
+
+def shard_of(user_account, shards):
+    """用户所属的分片（按学号的稳定哈希，与进程和 PYTHONHASHSEED 无关）"""
+    return zlib.crc32(user_account.encode("utf-8")) % shards
+
+
+def _init_shard_worker(db_path):
+    """分片工作进程初始化：使用与主进程相同的数据库"""
+    DatabaseManager.DB_PATH = db_path
+
+
+def _check_shard(accounts):
+    """
+    检查一个分片的用户（在分片工作进程中执行）
+
+    用户数据由工作进程自己从数据库读取，主进程只传递学号。
+    上一轮超时后仍在本进程中检查的用户跳过。
+    返回: ([(检查结果状态, 是否成功, 耗时)], 超时未完成的用户数, 跳过的用户数)
+    """
+    accounts = set(accounts)
+    with DatabaseManager(readonly=True) as conn:
+        users = [user for user in user_roster.users(conn, "active_users") if user["user_account"] in accounts]
+    with _in_flight_lock:
+        pending = [user for user in users if user["user_account"] not in _in_flight]
+        _in_flight.update(user["user_account"] for user in pending)
+    outcomes, timed_out = _check_in_threads(pending)
+    return outcomes, timed_out, len(users) - len(pending)
+
+
+def _shard_executor(index):
+    """获取第 index 个分片的工作进程，首次使用或进程异常退出后重新创建"""
+    with _shard_lock:
+        while len(_shard_executors) <= index:
+            _shard_executors.append(None)
+        executor = _shard_executors[index]
+        if executor is None:
+            # 使用 spawn 创建，避免 fork 时复制主进程的线程和数据库连接
+            executor = _shard_executors[index] = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_shard_worker,
+                initargs=(DatabaseManager.DB_PATH,),
+            )
+        return executor
+
+
+def _reset_shard_executor(index, executor):
+    with _shard_lock:
+        if index < len(_shard_executors) and _shard_executors[index] is executor:
+            _shard_executors[index] = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def stop_shard_workers():
+    """关闭全部分片工作进程"""
+    with _shard_lock:
+        executors = [executor for executor in _shard_executors if executor is not None]
+        _shard_executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _check_sharded(users, progress=None):
+    """
+    按学号哈希将用户分配到 SWEEP_PROCESSES 个工作进程检查，并汇总结果
+
+    同一用户总是分配到同一个分片（同一个进程）；分片任务结束前，其用户一直留在主进程的
+    检查中集合里，下一轮和保活都会跳过。分片任务超时返回后仍未完成的用户由工作进程自己的
+    检查中集合跳过，因此同一用户不会被同时检查两次。
+    返回: ([(检查结果状态, 是否成功, 耗时)], 超时未完成的用户数, 工作进程跳过的用户数)
+    """
+    shards = {}
+    for user in users:
+        shards.setdefault(shard_of(user["user_account"], SWEEP_PROCESSES), []).append(user["user_account"])
+
+    completed = [0]
+    completed_lock = threading.Lock()
+
+    def _release(accounts):
+        def callback(future):
+            with _in_flight_lock:
+                _in_flight.difference_update(accounts)
+            if progress is not None:
+                with completed_lock:
+                    completed[0] += len(accounts)
+                    done_count = completed[0]
+                progress(done_count, len(users))
+        return callback
+
+    futures = {}
+    for index, accounts in shards.items():
+        executor = _shard_executor(index)
+        try:
+            future = executor.submit(_check_shard, accounts)
+        except BrokenProcessPool:
+            _reset_shard_executor(index, executor)
+            executor = _shard_executor(index)
+            future = executor.submit(_check_shard, accounts)
+        future.add_done_callback(_release(accounts))
+        futures[future] = (index, accounts, executor)
+
+    done, not_done = wait(futures, timeout=SWEEP_DEADLINE + SHARD_GRACE)
+
+    outcomes = []
+    timed_out = 0
+    skipped = 0
+    for future in done:
+        index, accounts, executor = futures[future]
+        try:
+            shard_outcomes, shard_timed_out, shard_skipped = future.result()
+        except Exception as e:
+            logger.error(f"分片 {index} 检查出错（{len(accounts)} 个用户）: {str(e)}")
+            if isinstance(e, BrokenProcessPool):
+                _reset_shard_executor(index, executor)
+            shard_outcomes, shard_timed_out, shard_skipped = [("failed", False, 0.0)] * len(accounts), 0, 0
+        # 工作进程中的指标不会汇总到主进程，单个用户的检查耗时在此补记
+        for status, _, elapsed in shard_outcomes:
+            CHECK_DURATION.observe(elapsed, status=status)
+        outcomes.extend(shard_outcomes)
+        timed_out += shard_timed_out
+        skipped += shard_skipped
+    for future in not_done:
+        index, accounts, _ = futures[future]
+        logger.warning(f"分片 {index} 未在 {SWEEP_DEADLINE + SHARD_GRACE} 秒内返回结果")
+        timed_out += len(accounts)
+    return outcomes, timed_out, skipped
+
+
+def check_all_users(due_only=False, progress=None):
+    """并发检查所有启用的用户
+
+    使用有界线程池并发检查，单轮超过 SWEEP_DEADLINE 秒后不再等待剩余用户。
+    只检查本节点持有租约的用户（见 utils.leases.claim_leases）。
+    SWEEP_PROCESSES 大于 1 时按学号哈希将用户分片，交给多个工作进程检查（见 _check_sharded）。
+    due_only 为 True 时只检查已到下一次检查时间的用户。
+    progress 为可选的回调 progress(已完成数, 总数)，每完成一个用户调用一次。
+    返回本轮检查的统计信息。
+    """
+    global last_sweep_summary
+
+    started = time.monotonic()
+
+    # 续期租约，多节点部署时只检查本节点负责的用户
+    with _in_flight_lock:
+        busy = set(_in_flight)
+    owned = claim_leases(busy)
+
+    with DatabaseManager(readonly=True) as conn:
+        if due_only:
+            users = user_roster.users(conn, "due_users", (get_timestamp(),))
+        else:
+            users = user_roster.users(conn, "active_users")
+    users = [user for user in users if user["user_account"] in owned]
+
+    if due_only and not users:
+        return None
+    logger.info("开始检查到期用户成绩" if due_only else "开始检查所有用户成绩")
 
-            if page_hash is not None and scores is not None:
-                # 传递连接以避免嵌套事务
-                new_courses = compare_scores(user_account, page_hash, scores, conn)
+    # 跳过上一轮仍在检查中的用户
+    with _in_flight_lock:
+        pending = [user for user in users if user["user_account"] not in _in_flight]
+        _in_flight.update(user["user_account"] for user in pending)
+    skipped = len(users) - len(pending)
 
-                if new_courses:
-                    logger.info(f"用户 {user_account} 发现新成绩: {len(new_courses)}门")
-                    notify_new_scores(user["dingtalk_webhook"], user["dingtalk_secret"], new_courses, user_account)
-                    return {"success": True, "message": f"发现 {len(new_courses)} 门新成绩，已发送通知", "status": "new_scores", "count": len(new_courses)}
-                else:
-                    logger.info(f"用户 {user_account} 无新成绩")
-                    return {"success": True, "message": "暂无新成绩", "status": "no_change"}
+    if SWEEP_PROCESSES > 1:
+        outcomes, timed_out, busy = _check_sharded(pending, progress)
+        skipped += busy
+    else:
+        outcomes, timed_out = _check_in_threads(pending, progress)
+
+    latencies = sorted(elapsed for _, _, elapsed in outcomes)
+    statuses = {}
+    for status, _, _ in outcomes:
+        statuses[status] = statuses.get(status, 0) + 1
+    summary = {
+        "total": len(users),
+        "checked": len(outcomes),
+        "failed": sum(1 for _, success, _ in outcomes if not success),
+        "timed_out": timed_out,
+        "skipped": skipped,
+        "statuses": statuses,
+        "latency_p50": round(_percentile(latencies, 50), 3),
+        "latency_p95": round(_percentile(latencies, 95), 3),
+        "duration": round(time.monotonic() - started, 3),
+        "finished_at": get_timestamp(),
+    }
+    last_sweep_summary = summary
+
+    SWEEP_DURATION.observe(summary["duration"])
+    SWEEP_LAST_DURATION.set(summary["duration"])
+    SWEEP_LAST_FINISHED.set(summary["finished_at"])
+    for result in ("checked", "failed", "timed_out", "skipped"):
+        SWEEP_USERS.inc(summary[result], result=result)
+
+    if timed_out:
+        logger.warning(f"本轮检查超过 {SWEEP_DEADLINE} 秒，{timed_out} 个用户未完成")
+    logger.info(
+        f"检查完成: 共 {summary['total']} 个用户，已检查 {summary['checked']}，失败 {summary['failed']}，"
+        f"超时 {timed_out}，跳过 {skipped}，"
+        f"耗时 p50={summary['latency_p50']}s p95={summary['latency_p95']}s，总耗时 {summary['duration']}s"
+    )
+    return summary
+
+
+def check_due_users():
+    """检查已到下一次检查时间的用户（定时任务入口）"""
+    return check_all_users(due_only=True)
+
+
+def _ping_session(user, writes):
+    """
+    访问轻量页面保活单个用户的 session
+
+    返回: True 表示 session 有效，False 表示已过期（已提交重新登录），None 表示请求失败
+    """
+    user_account = user["user_account"]
+    try:
+        session = get_user_session(user_account, user["encrypted_session"], user["encryption_key"])
+        response = session.get(KEEPALIVE_URL, timeout=10)
+    except Exception as e:
+        logger.debug(f"用户 {user_account} 保活请求失败: {str(e)}")
+        return None
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(user_account)
 
-            return {"success": False, "message": "获取成绩失败"}
+    if response.status_code != 200:
+        return None
 
-        except Exception as e:
-            logger.error(f"检查用户 {user_account} 时出错: {str(e)}")
-            return {"success": False, "message": str(e)}
+    if check_session_expired(response.text):
+        # 在检查之外提前重新登录，避免浪费下一次成绩检查
+        logger.info(f"用户 {user_account} 的session已过期（保活检测），提交重新登录")
+        session_cache.invalidate(user_account)
+        now = get_timestamp()
+        expired_at = user["session_expired_at"] or now
+        with DatabaseManager() as conn:
+            conn.execute(
+                STATEMENTS["mark_session_expired_at_lifetime"],
+                (expired_at, learn_session_lifetime(user, now, alive=False), user_account),
+            )
+        relogin_queue.submit(user, expired_at)
+        return False
 
+    queue_session_write(writes, user, session)
+    return True
 
-def check_all_users():
-    """检查所有启用的用户"""
-    logger.info("开始检查所有用户成绩")
 
-    with DatabaseManager() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT user_account, encrypted_password, encrypted_session, encryption_key, dingtalk_webhook, dingtalk_secret FROM users WHERE enabled = 1 AND session_expired = 0"
-        )
-        users = cursor.fetchall()
+def _parse_hours(value):
+    """解析低峰时段配置（起始时-结束时，可跨零点），返回 (起始时, 结束时)，格式错误时返回 None"""
+    try:
+        start, end = (int(part) for part in value.split("-"))
+    except ValueError:
+        logger.warning(f"低峰时段配置格式错误，已禁用寿命探测: {value}")
+        return None
+    return start % 24, end % 24
 
-        for user in users:
-            user_account = user["user_account"]
-            dingtalk_webhook = user["dingtalk_webhook"]
-            dingtalk_secret = user["dingtalk_secret"]
 
-            # 更新最近检查时间
-            cursor.execute(
-                "UPDATE users SET last_check_at = ? WHERE user_account = ?",
-                (get_timestamp(), user_account),
-            )
+_probe_hours = _parse_hours(KEEPALIVE_PROBE_HOURS)
 
-            try:
-                session = restore_session(user["encrypted_session"], user["encryption_key"])
-                page_hash, scores, expired = fetch_scores(session)
 
-                if expired:
-                    logger.warning(f"用户 {user_account} 的session已过期，尝试自动重新登录")
-                    handle_expired_session(cursor, user, dingtalk_webhook, dingtalk_secret)
-                    continue
+def in_probe_hours(timestamp=None):
+    """判断给定时间是否处于可以探测 session 寿命的低峰时段"""
+    if _probe_hours is None or KEEPALIVE_PROBE_EVERY <= 0:
+        return False
+    start, end = _probe_hours
+    hour = datetime.datetime.fromtimestamp(timestamp or get_timestamp()).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
 
-                if page_hash is not None and scores is not None:
-                    # 传递连接以避免嵌套事务
-                    new_courses = compare_scores(user_account, page_hash, scores, conn)
 
-                    if new_courses:
-                        logger.info(f"用户 {user_account} 发现新成绩: {len(new_courses)}门")
-                        notify_new_scores(dingtalk_webhook, dingtalk_secret, new_courses, user_account)
-                    else:
-                        logger.info(f"用户 {user_account} 无新成绩")
+def _probe_pending(user, now, probing):
+    """
+    本次空闲期是否推迟保活、等待空闲时间超过预计寿命后再探测
 
-            except Exception as e:
-                logger.error(f"检查用户 {user_account} 时出错: {str(e)}")
+    按 (学号, 最近活跃时间) 的哈希选出约 1/KEEPALIVE_PROBE_EVERY 的空闲期，同一空闲期内每次扫描的选择一致。
+    """
+    if not probing:
+        return False
+    if zlib.crc32(f"{user['user_account']}:{user['last_active_at']}".encode()) % KEEPALIVE_PROBE_EVERY:
+        return False
+    lifetime = user["session_lifetime"] or SESSION_LIFETIME_DEFAULT
+    probe_at = min(lifetime * KEEPALIVE_PROBE_FACTOR, SESSION_LIFETIME_MAX)
+    return now - user["last_active_at"] < probe_at
+
+
+def keep_sessions_alive():
+    """
+    保活即将过期的 session（定时任务入口）
+
+    选出空闲时间接近预计寿命、且短时间内不会被成绩检查访问到的用户，访问一次轻量页面。
+    低峰时段内部分用户推迟到超过预计寿命后再访问（见 KEEPALIVE_PROBE_EVERY），用于发现更长的寿命；
+    此时已过期的 session 由 _ping_session 立即提交重新登录。
+    """
+    now = get_timestamp()
+    with DatabaseManager(readonly=True) as conn:
+        users = user_roster.users(
+            conn, "idle_users", (now, SESSION_LIFETIME_DEFAULT, KEEPALIVE_MARGIN, now + KEEPALIVE_TICK)
+        )
+    # 与成绩检查一样只处理本节点持有租约的用户，同时续期租约（长时间的检查进行中也不会过期）
+    with _in_flight_lock:
+        busy = set(_in_flight)
+    owned = claim_leases(busy)
+    users = [user for user in users if user["user_account"] in owned]
+
+    probing = in_probe_hours(now)
+    users = [user for user in users if not _probe_pending(user, now, probing)]
+
+    with _in_flight_lock:
+        users = [user for user in users if user["user_account"] not in _in_flight]
+        _in_flight.update(user["user_account"] for user in users)
+    if not users:
+        return
+
+    writes = WriteBatcher()
+    with ThreadPoolExecutor(max_workers=KEEPALIVE_WORKERS, thread_name_prefix="keepalive") as executor:
+        results = list(executor.map(lambda user: _ping_session(user, writes), users))
+
+    now = get_timestamp()
+    for user, alive in zip(users, results):
+        if alive:
+            writes.add(
+                STATEMENTS["update_activity"],
+                (now, learn_session_lifetime(user, now, alive=True), user["user_account"]),
+            )
+    flush_writes(writes)
 
-    logger.info("检查完成")
+    KEEPALIVE_TOTAL.inc(results.count(True), result="alive")
+    KEEPALIVE_TOTAL.inc(results.count(False), result="expired")
+    KEEPALIVE_TOTAL.inc(results.count(None), result="error")
+    alive_count = sum(1 for alive in results if alive)
+    logger.info(f"Session 保活完成: 共 {len(users)} 个用户，有效 {alive_count}，已过期 {results.count(False)}")
 
 
 def start_scheduler():
     """启动定时任务"""
-    scheduler.add_job(check_all_users, "interval", minutes=5, id="check_scores")
+    scheduler.add_job(
+        check_due_users, "interval", seconds=SCHEDULER_TICK, id="check_scores",
+        max_instances=1, coalesce=True,
+    )
+    scheduler.add_job(
+        keep_sessions_alive, "interval", seconds=KEEPALIVE_TICK, id="keep_sessions_alive",
+        max_instances=1, coalesce=True,
+    )
     scheduler.start()
-    logger.info("定时任务已启动，每5分钟检查一次")
+    start_dispatcher()
+    logger.info(
+        f"定时任务已启动，每 {SCHEDULER_TICK} 秒扫描到期用户，"
+        f"检查间隔 {CHECK_INTERVAL_MIN}~{CHECK_INTERVAL_MAX} 秒自适应调整"
+    )
 
 
 def stop_scheduler():
     """停止定时任务"""
     scheduler.shutdown()
+    stop_dispatcher()
+    stop_shard_workers()
     logger.info("定时任务已停止")
@@ -0,0 +1,74 @@
+"""
+成绩逐课程对比（utils.score_monitor.compare_scores）
+
+使用临时数据库，在项目根目录执行:
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from models import DatabaseManager
+from utils.score_monitor import compare_scores, score_fingerprint
+
+
+def _score(course_id, grade, exam_type="正常考试", retake_term="", term="2023-2024-1"):
+    return {
+        '序号': "1", '开课学期': term, '课程编号': course_id, '课程名称': f"课程{course_id}", '分组名': "",
+        '成绩': grade, '成绩标识': "", '学分': "2", '总学时': "32", '绩点': "1.0", '补重学期': retake_term,
+        '考核方式': "考试", '考试性质': exam_type, '课程属性': "必修", '课程性质': "", '课程类别': "",
+    }
+
+
+def _compare(user_account, scores):
+    changes = compare_scores(user_account, score_fingerprint(scores), scores)
+    return [(score['课程编号'], score['考试性质'], score['成绩']) for score in changes]
+
+
+class CompareScoresTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="qfnu-test-")
+        DatabaseManager.close_pool()
+        DatabaseManager.DB_PATH = os.path.join(self.workdir, "monitor.db")
+
+    def tearDown(self):
+        DatabaseManager.close_pool()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_first_check_does_not_notify(self):
+        self.assertEqual(_compare("u1", [_score("A", "90"), _score("B", "80")]), [])
+
+    def test_new_course_and_changed_grade(self):
+        _compare("u1", [_score("A", "90")])
+        self.assertEqual(_compare("u1", [_score("A", "90"), _score("B", "80")]), [("B", "正常考试", "80")])
+
+        changes = compare_scores("u1", "changed", [_score("A", "95"), _score("B", "80")])
+        self.assertEqual([(score['课程编号'], score['成绩'], score['原成绩']) for score in changes], [("A", "95", "90")])
+
+    def test_makeup_exam_rows_are_separate_courses(self):
+        # 同一课程的正常考试与补考课程编号、开课学期相同，只有考试性质和补重学期不同
+        original = _score("D", "60")
+        makeup = _score("D", "70", exam_type="补考", retake_term="2023-2024-2")
+        _compare("u1", [original, makeup])
+
+        # 新增其他课程时只通知该课程，不会把 D 的两行误判为成绩更新
+        self.assertEqual(_compare("u1", [original, makeup, _score("E", "85")]), [("E", "正常考试", "85")])
+        self.assertEqual(_compare("u1", [original, makeup, _score("E", "85"), _score("F", "75")]), [("F", "正常考试", "75")])
+
+        # 新出现的重修成绩单独通知
+        retake = _score("E", "90", exam_type="重修", retake_term="2024-2025-1")
+        self.assertEqual(
+            _compare("u1", [original, makeup, _score("E", "85"), _score("F", "75"), retake]),
+            [("E", "重修", "90")],
+        )
+
+    def test_identical_rows_do_not_flap(self):
+        rows = [_score("D", "60"), _score("D", "70")]
+        _compare("u1", rows)
+        self.assertEqual(_compare("u1", rows + [_score("E", "85")]), [("E", "正常考试", "85")])
+        self.assertEqual(_compare("u1", rows + [_score("E", "85"), _score("F", "75")]), [("F", "正常考试", "75")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,156 @@
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import Future, ProcessPoolExecutor
 import ddddocr
 from utils.logger import logger
-ocr = ddddocr.DdddOcr(show_ad=False)
+from utils.metrics import Counter, Histogram
+
+# OCR 工作进程数，0 表示在当前进程内识别
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 0))
+OCR_TIMEOUT = 30  # 单次识别最长等待时间（秒）
+
+# 当前进程内的 OCR 实例（按需加载）
+_ocr = None
+_ocr_lock = threading.Lock()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+OCR_DURATION = Histogram(
+    "monitor_ocr_duration_seconds", "单张验证码识别耗时", buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+OCR_TOTAL = Counter("monitor_ocr_recognitions_total", "验证码识别次数，按结果分类（ok/error）")
+CAPTCHA_ATTEMPTS = Counter("monitor_captcha_attempts_total", "使用识别结果登录的次数，按验证码是否被接受分类")
+
+
+def _get_ocr():
+    """获取当前进程内的 OCR 实例，首次调用时加载模型"""
+    global _ocr
+    if _ocr is None:
+        with _ocr_lock:
+            if _ocr is None:
+                _ocr = ddddocr.DdddOcr(show_ad=False)
+    return _ocr
+
+
+def _warm_up():
+    """工作进程初始化：预先加载模型"""
+    _get_ocr()
+
+
+def _classify(image_bytes):
+    """识别单张验证码（在工作进程中执行）"""
+    return _get_ocr().classification(image_bytes)
+
+
+def _to_bytes(image):
+    """将 PIL 图片转换为字节，便于传给工作进程"""
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def start_ocr_pool(workers=OCR_WORKERS):
+    """
+    启动 OCR 进程池，每个工作进程预先加载一个 ddddocr 模型
+
+    应在启动其他后台线程之前调用（工作进程通过 fork 创建）。
+    workers 为 0 或当前平台不支持 fork 时不启动进程池，识别在当前进程内完成。
+    """
+    global _pool
+    if workers <= 0 or _pool is not None:
+        return
+    if sys.platform == "win32" or "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("当前平台不支持 fork，OCR 进程池未启动，将在当前进程内识别")
+        return
+
+    with _pool_lock:
+        if _pool is not None:
+            return
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_warm_up,
+        )
+        # 立即创建全部工作进程并完成模型加载
+        for future in [_pool.submit(_warm_up) for _ in range(workers)]:
+            future.result()
+    logger.info(f"OCR 进程池已启动，共 {workers} 个工作进程")
+
+
+def stop_ocr_pool():
+    """关闭 OCR 进程池"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def submit_ocr(image):
+    """
+    提交一张验证码进行识别
+
+    参数:
+        image: 验证码图片数据（bytes 或 PIL 图片）
+    返回: concurrent.futures.Future，结果为识别出的字符串
+    """
+    if _pool is not None:
+        return _pool.submit(_classify, _to_bytes(image))
+
+    future = Future()
+    try:
+        future.set_result(_get_ocr().classification(image))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def recognize_batch(images):
+    """
+    批量识别验证码
+
+    所有图片先一起提交，进程池启动时会在多个工作进程中并行识别。
+    参数:
+        images: 验证码图片数据列表
+    返回:
+        与输入顺序一致的识别结果列表，识别失败的位置为 None
+    """
+    if not images:
+        return []
+
+    started = time.monotonic()
+    futures = [submit_ocr(image) for image in images]
+    results = []
+    for future in futures:
+        try:
+            res = future.result(timeout=OCR_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"OCR识别出错: {str(e)}")
+            res = None
+        results.append(res or None)
+
+    # 并行识别无法区分单张耗时，按平均耗时记录
+    elapsed = (time.monotonic() - started) / len(images)
+    for res in results:
+        _record_recognition(elapsed, bool(res))
+    return results
+
+
+def _record_recognition(elapsed, ok):
+    OCR_DURATION.observe(elapsed)
+    OCR_TOTAL.inc(result="ok" if ok else "error")
+
+
+def record_attempt(success):
+    """记录一次使用识别结果登录的结果（验证码是否被接受）"""
+    CAPTCHA_ATTEMPTS.inc(result="accepted" if success else "rejected")
 
 
 def get_ocr_res(cap_pic_bytes):
@@ -11,12 +161,15 @@ def get_ocr_res(cap_pic_bytes):
     返回:
         识别结果字符串，失败返回 None
     """
+    started = time.monotonic()
     try:
-        res = ocr.classification(cap_pic_bytes)
+        res = submit_ocr(cap_pic_bytes).result(timeout=OCR_TIMEOUT)
+        _record_recognition(time.monotonic() - started, bool(res))
         if res and len(res) > 0:
             return res
         return None
     except Exception as e:
+        _record_recognition(time.monotonic() - started, False)
         logger.warning(f"OCR识别出错: {str(e)}")
         return None
 
@@ -1,26 +1,56 @@
+import os
 import requests
 import json
 import time
 import hmac
 import hashlib
 import base64
+import uuid
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from urllib.parse import quote_plus
 from utils.logger import logger
+from utils import metrics
 
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))  # 并发发送的机器人数
+OUTBOX_POLL_INTERVAL = 5  # 发件箱轮询间隔（秒）
+OUTBOX_BATCH_SIZE = 200  # 每轮最多处理的消息数
+OUTBOX_CLAIM_TTL = 120  # 认领消息的有效期（秒），应大于一轮发送的耗时
+MAX_SEND_ATTEMPTS = 5  # 单条消息最大发送次数
+RETRY_BASE_DELAY = 30  # 重试退避基数（秒），第 n 次失败后等待 RETRY_BASE_DELAY * 2^(n-1)
+ROBOT_RATE_LIMIT = 20  # 钉钉单个机器人每分钟最多发送 20 条消息
+ROBOT_RATE_WINDOW = 60
 
-def increment_push_count(user_account):
-    """增加用户的推送计数"""
+SEND_DURATION = metrics.Histogram("monitor_dingtalk_send_duration_seconds", "单条钉钉消息发送耗时")
+MESSAGES_TOTAL = metrics.Counter("monitor_dingtalk_messages_total", "钉钉消息发送结果（sent/retry/failed）")
+RATE_LIMITED_TOTAL = metrics.Counter("monitor_dingtalk_rate_limited_total", "因机器人每分钟限额推迟发送的次数")
+
+
+def _outbox_counts():
+    """按状态统计发件箱中的消息数"""
     from models import DatabaseManager
 
-    try:
-        with DatabaseManager() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE users SET push_count = push_count + 1 WHERE user_account = ?",
-                (user_account,),
-            )
-    except Exception as e:
-        logger.error(f"增加推送计数失败: {str(e)}")
+    with DatabaseManager(readonly=True) as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+    return [({"status": status}, count) for status, count in rows]
+
+
+OUTBOX_MESSAGES = metrics.Gauge("monitor_outbox_messages", "发件箱中的消息数，按状态分类", func=_outbox_counts)
+
+# 发送消息使用的连接池
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_maxsize=OUTBOX_WORKERS))
+_http.mount("http://", HTTPAdapter(pool_maxsize=OUTBOX_WORKERS))
+
+# 每个机器人最近一分钟内的发送时间
+_sent_times = {}
+_rate_lock = threading.Lock()
+
+_dispatcher_thread = None
+_wakeup = threading.Event()
+_stop = threading.Event()
 
 
 def generate_sign(secret):
@@ -36,41 +66,246 @@ def generate_sign(secret):
     return timestamp, sign
 
 
-def send_dingtalk_message(webhook_url, secret, message, user_account=None):
-    """发送钉钉消息"""
+def enqueue_message(webhook_url, secret, data, user_account=None):
+    """
+    将消息写入发件箱，由后台发送线程异步发送
+
+    返回: 是否成功写入发件箱
+    """
+    from models import DatabaseManager, get_timestamp
+
     if not webhook_url or not secret:
         return False
 
-    timestamp, sign = generate_sign(secret)
-    url = f"{webhook_url}&timestamp={timestamp}&sign={sign}"
+    try:
+        now = get_timestamp()
+        with DatabaseManager() as conn:
+            conn.execute(
+                "INSERT INTO outbox (user_account, webhook_url, secret, payload, status, attempts, next_attempt_at, created_at) VALUES (?, ?, ?, ?, 'pending', 0, ?, ?)",
+                (user_account, webhook_url, secret, json.dumps(data, ensure_ascii=False), now, now),
+            )
+    except Exception as e:
+        logger.error(f"钉钉消息写入发件箱失败: {str(e)}")
+        return False
+
+    _wakeup.set()
+    return True
 
+
+def _acquire_rate_slot(webhook_url):
+    """占用机器人的一个发送名额，超出每分钟限额时返回 False"""
+    now = time.monotonic()
+    with _rate_lock:
+        sent = _sent_times.setdefault(webhook_url, deque())
+        while sent and now - sent[0] >= ROBOT_RATE_WINDOW:
+            sent.popleft()
+        if len(sent) >= ROBOT_RATE_LIMIT:
+            return False
+        sent.append(now)
+        return True
+
+
+def _post_message(row):
+    """发送单条发件箱消息，返回错误信息，成功返回 None"""
+    timestamp, sign = generate_sign(row["secret"])
+    url = f"{row['webhook_url']}&timestamp={timestamp}&sign={sign}"
     headers = {"Content-Type": "application/json"}
-    data = {"msgtype": "text", "text": {"content": message}}
 
     try:
-        response = requests.post(
-            url, headers=headers, data=json.dumps(data), timeout=10
+        response = _http.post(
+            url, headers=headers, data=row["payload"].encode("utf-8"), timeout=10
         )
-        if response.status_code == 200 and user_account:
-            increment_push_count(user_account)
-        return response.status_code == 200
     except Exception as e:
-        logger.error(f"发送钉钉消息失败: {str(e)}")
-        return False
+        return str(e)
+
+    if response.status_code != 200:
+        return f"状态码: {response.status_code}, 响应内容: {response.text[:200]}"
+    try:
+        errcode = response.json().get("errcode", 0)
+    except ValueError:
+        errcode = 0
+    if errcode != 0:
+        return f"钉钉返回错误: {response.text[:200]}"
+    return None
+
+
+def _send_robot_batch(rows):
+    """
+    按顺序发送同一机器人的消息，某条发送失败时停止，后续消息留待其重试后再发送
+
+    返回: [(row, error)]，因限流或前一条失败而未发送的消息不包含在内
+    """
+    results = []
+    for row in rows:
+        if not _acquire_rate_slot(row["webhook_url"]):
+            RATE_LIMITED_TOTAL.inc()
+            break
+        with SEND_DURATION.time():
+            error = _post_message(row)
+        results.append((row, error))
+        if error is not None:
+            break
+    return results
+
+
+def dispatch_pending():
+    """
+    发送发件箱中到期的消息
+
+    不同机器人的消息并发发送，同一机器人的消息按写入顺序发送并遵守每分钟限额；
+    某条消息发送失败后，同一机器人的后续消息等它重试成功或最终失败后再发送。
+    发送前先认领消息（写入认领标识和有效期），多个节点或多个线程共用发件箱时同一条消息只发送一次；
+    认领者异常退出时，认领过期后由其他节点重新发送。
+    发送结果与推送计数在一个事务中批量写回。
+    返回: 本轮成功发送的消息数
+    """
+    from models import DatabaseManager, STATEMENTS, get_timestamp
+    from utils.leases import NODE_ID
+
+    now = get_timestamp()
+    with DatabaseManager(readonly=True) as conn:
+        pending = conn.execute(
+            "SELECT 1 FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? AND (claimed_until IS NULL OR claimed_until <= ?) LIMIT 1",
+            (now, now),
+        ).fetchone()
+    if pending is None:
+        return 0
+
+    claim = f"{NODE_ID}/{uuid.uuid4().hex[:8]}"
+    with DatabaseManager() as conn:
+        conn.execute(
+            "UPDATE outbox SET claimed_by = ?, claimed_until = ? WHERE id IN ("
+            "SELECT id FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+            "AND (claimed_until IS NULL OR claimed_until <= ?) "
+            # 同一机器人更早的消息仍在等待重试或已被其他节点认领时暂不发送，保持发送顺序
+            "AND NOT EXISTS (SELECT 1 FROM outbox AS earlier WHERE earlier.webhook_url = outbox.webhook_url "
+            "AND earlier.status = 'pending' AND earlier.id < outbox.id "
+            "AND (earlier.next_attempt_at > ? OR earlier.claimed_until > ?)) "
+            "ORDER BY id LIMIT ?)",
+            (claim, now + OUTBOX_CLAIM_TTL, now, now, now, now, OUTBOX_BATCH_SIZE),
+        )
+        rows = conn.execute(
+            "SELECT id, user_account, webhook_url, secret, payload, attempts FROM outbox WHERE claimed_by = ? ORDER BY id",
+            (claim,),
+        ).fetchall()
+
+    if not rows:
+        return 0
+
+    by_robot = {}
+    for row in rows:
+        by_robot.setdefault(row["webhook_url"], []).append(row)
+
+    with ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix="dingtalk") as executor:
+        batches = list(executor.map(_send_robot_batch, by_robot.values()))
+
+    sent_ids = []
+    retries = []
+    failed = []
+    push_counts = Counter()
+    now = get_timestamp()
+    for row, error in (item for batch in batches for item in batch):
+        if error is None:
+            sent_ids.append((row["id"],))
+            if row["user_account"]:
+                push_counts[row["user_account"]] += 1
+            continue
+
+        attempts = row["attempts"] + 1
+        logger.error(f"发送钉钉消息失败（第{attempts}次）: {error}")
+        if attempts >= MAX_SEND_ATTEMPTS:
+            failed.append((attempts, error, row["id"]))
+        else:
+            delay = RETRY_BASE_DELAY * 2 ** (attempts - 1)
+            retries.append((attempts, now + delay, error, row["id"]))
+
+    try:
+        with DatabaseManager() as conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", sent_ids)
+            conn.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL, claimed_until = NULL WHERE id = ?",
+                retries,
+            )
+            conn.executemany(
+                "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, claimed_by = NULL, claimed_until = NULL WHERE id = ?",
+                failed,
+            )
+            conn.executemany(
+                STATEMENTS["add_push_count"],
+                [(count, user_account) for user_account, count in push_counts.items()],
+            )
+            # 因限流或同一机器人前一条失败而未发送的消息解除认领，下一轮重新发送
+            conn.execute(
+                "UPDATE outbox SET claimed_by = NULL, claimed_until = NULL WHERE claimed_by = ?", (claim,)
+            )
+    except Exception as e:
+        logger.error(f"更新发件箱状态失败: {str(e)}")
+
+    MESSAGES_TOTAL.inc(len(sent_ids), result="sent")
+    MESSAGES_TOTAL.inc(len(retries), result="retry")
+    MESSAGES_TOTAL.inc(len(failed), result="failed")
+    if sent_ids:
+        logger.info(f"钉钉消息发送成功 {len(sent_ids)} 条")
+    return len(sent_ids)
+
+
+def _dispatch_loop():
+    """后台发送线程"""
+    while not _stop.is_set():
+        try:
+            dispatch_pending()
+        except Exception as e:
+            logger.error(f"发件箱处理出错: {str(e)}")
+        _wakeup.wait(OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start_dispatcher():
+    """启动后台发送线程"""
+    global _dispatcher_thread
+    if _dispatcher_thread is not None and _dispatcher_thread.is_alive():
+        return
+    _stop.clear()
+    _dispatcher_thread = threading.Thread(target=_dispatch_loop, name="dingtalk-outbox", daemon=True)
+    _dispatcher_thread.start()
+    logger.info("钉钉消息发送线程已启动")
+
+
+def stop_dispatcher():
+    """停止后台发送线程"""
+    global _dispatcher_thread
+    if _dispatcher_thread is None:
+        return
+    _stop.set()
+    _wakeup.set()
+    _dispatcher_thread.join(timeout=15)
+    _dispatcher_thread = None
+    logger.info("钉钉消息发送线程已停止")
+
+
+def send_dingtalk_message(webhook_url, secret, message, user_account=None):
+    """发送钉钉文本消息（写入发件箱）"""
+    data = {"msgtype": "text", "text": {"content": message}}
+    return enqueue_message(webhook_url, secret, data, user_account)
 
 
 def notify_new_scores(webhook_url, secret, new_courses, user_account=None):
     """通知新成绩"""
     if not new_courses:
         return True
+    return enqueue_message(webhook_url, secret, build_new_scores_message(new_courses), user_account)
 
-    # 构建markdown格式的消息
+
+def build_new_scores_message(new_courses):
+    """构建新成绩通知的 markdown 消息"""
     message = "# 🎉 新成绩通知\n\n"
     message += f"检测到 **{len(new_courses)}** 门新成绩！\n\n"
 
     for course in new_courses:
         message += "---\n\n"
         message += f"### 📚 {course['课程名称']}\n\n"
+        if "原成绩" in course:
+            message += f"- **成绩更新**: {course['原成绩']} → {course['成绩']}\n"
         message += f"- **成绩**: {course['成绩']}\n"
         message += f"- **绩点**: {course['绩点']}\n"
         message += f"- **学分**: {course['学分']}\n"
@@ -89,23 +324,7 @@ def notify_new_scores(webhook_url, secret, new_courses, user_account=None):
             message += f"- **补重学期**: {course['补重学期']}\n"
         message += "\n"
 
-    timestamp, sign = generate_sign(secret)
-    url = f"{webhook_url}&timestamp={timestamp}&sign={sign}"
-
-    headers = {"Content-Type": "application/json"}
-    data = {"msgtype": "markdown", "markdown": {"title": "新成绩通知", "text": message}}
-
-    try:
-        response = requests.post(
-            url, headers=headers, data=json.dumps(data), timeout=10
-        )
-        if response.status_code == 200 and user_account:
-            logger.info("新成绩通知发送成功")
-            increment_push_count(user_account)
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"发送钉钉消息失败: {str(e)}")
-        return False
+    return {"msgtype": "markdown", "markdown": {"title": "新成绩通知", "text": message}}
 
 
 def notify_session_expired(webhook_url, secret, user_account=None):
@@ -130,28 +349,8 @@ def notify_init_scores(webhook_url, secret, scores, user_account=None):
     message += "\n---\n\n"
     message += "✅ 成绩监控已启动，后台将每隔一段时间检测一次是否有新成绩，发现新成绩会自动通过钉钉上报。"
 
-    timestamp, sign = generate_sign(secret)
-    url = f"{webhook_url}&timestamp={timestamp}&sign={sign}"
-
-    headers = {"Content-Type": "application/json"}
     data = {
         "msgtype": "markdown",
         "markdown": {"title": "成绩监控初始化成功", "text": message},
     }
-
-    try:
-        response = requests.post(
-            url, headers=headers, data=json.dumps(data), timeout=10
-        )
-        if response.status_code != 200:
-            logger.error(
-                f"发送钉钉消息失败，状态码: {response.status_code}, 响应内容: {response.text}"
-            )
-        else:
-            logger.info("初始化成绩通知发送成功")
-            if user_account:
-                increment_push_count(user_account)
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"发送钉钉消息失败: {str(e)}")
-        return False
+    return enqueue_message(webhook_url, secret, data, user_account)
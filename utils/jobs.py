@@ -0,0 +1,132 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from utils.logger import logger
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))  # 同时执行的后台任务数
+JOB_HISTORY = 200  # 最多保留的任务记录数（超出时丢弃最早完成的任务）
+
+
+class Job:
+    """后台任务，记录状态、进度和结果"""
+
+    __slots__ = (
+        "id", "kind", "status", "done", "total", "message",
+        "result", "created_at", "started_at", "finished_at", "_lock",
+    )
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "pending"  # pending / running / succeeded / failed
+        self.done = 0
+        self.total = None
+        self.message = ""
+        self.result = None
+        self.created_at = int(time.time())
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed")
+
+    def progress(self, done, total=None, message=None):
+        """更新任务进度，供任务函数调用"""
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            if message is not None:
+                self.message = message
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "progress": {"done": self.done, "total": self.total},
+                "message": self.message,
+                "result": self.result,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobQueue:
+    """
+    后台任务队列
+
+    任务在线程池中执行，任务函数的第一个参数为 Job，用于上报进度；
+    返回值作为任务结果，返回 {"success": False, ...} 或抛出异常时任务标记为失败。
+    """
+
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.history = history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, kind, func, *args, unique=False):
+        """
+        提交任务
+
+        参数:
+            kind: 任务类型
+            unique: 为 True 时，同类型任务尚未完成则直接返回该任务，不重复提交
+        返回: Job
+        """
+        with self._lock:
+            if unique:
+                for job in self._jobs.values():
+                    if job.kind == kind and not job.finished:
+                        return job
+            job = Job(kind)
+            self._jobs[job.id] = job
+            self._evict()
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def _evict(self):
+        """丢弃最早完成的任务记录，未完成的任务始终保留"""
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for job_id in [job.id for job in self._jobs.values() if job.finished][:excess]:
+            del self._jobs[job_id]
+
+    def _run(self, job, func, args):
+        with job._lock:
+            job.status = "running"
+            job.started_at = int(time.time())
+        try:
+            result = func(job, *args)
+            failed = isinstance(result, dict) and result.get("success") is False
+        except Exception as e:
+            logger.error(f"后台任务 {job.kind}({job.id}) 执行出错: {str(e)}")
+            result = {"success": False, "message": str(e)}
+            failed = True
+        with job._lock:
+            job.result = result
+            job.status = "failed" if failed else "succeeded"
+            if isinstance(result, dict) and result.get("message"):
+                job.message = result["message"]
+            job.finished_at = int(time.time())
+
+    def get(self, job_id):
+        """获取任务，不存在时返回 None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        """停止接收新任务，并取消尚未开始的任务"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,54 @@
+import os
+import math
+import socket
+from models import DatabaseManager, STATEMENTS, get_timestamp
+from utils.logger import logger
+
+# 节点标识，多个监控节点共用一个数据库时必须各不相同（默认为主机名）
+NODE_ID = os.getenv("NODE_ID") or socket.gethostname()
+# 用户租约有效期（秒）。节点每轮扫描时续期，超过该时间未续期视为节点已下线，其用户由其他节点接管；
+# 应大于 SWEEP_DEADLINE 与扫描间隔之和
+LEASE_TTL = int(os.getenv("LEASE_TTL", 600))
+
+
+def claim_leases(busy=()):
+    """
+    续期并认领本节点负责检查的用户
+
+    在一个写事务中完成（多个节点的认领互斥）：
+    1. 登记本节点心跳，续期本节点持有的租约，释放已停用或已过期用户的租约；
+    2. 按存活节点数计算每个节点应负责的用户数；
+    3. 超出份额时释放多余的租约（正在检查中的用户除外），由其他节点认领；
+       不足时认领无人持有或租约已过期（节点下线）的用户。
+
+    参数:
+        busy: 正在检查中的学号，不会被释放
+    返回: 本节点持有租约的学号集合
+    """
+    now = get_timestamp()
+    expires_at = now + LEASE_TTL
+    with DatabaseManager() as conn:
+        conn.execute(STATEMENTS["heartbeat_node"], (NODE_ID, expires_at))
+        conn.execute(STATEMENTS["prune_nodes"], (now,))
+        conn.execute(STATEMENTS["renew_leases"], (expires_at, NODE_ID))
+        conn.execute(STATEMENTS["drop_inactive_leases"], (NODE_ID,))
+
+        total = conn.execute(STATEMENTS["count_active_users"]).fetchone()[0]
+        nodes = conn.execute(STATEMENTS["count_live_nodes"], (now,)).fetchone()[0]
+        share = math.ceil(total / max(nodes, 1))
+        owned = [row[0] for row in conn.execute(STATEMENTS["owned_leases"], (NODE_ID, now))]
+
+        if len(owned) > share:
+            excess = [account for account in reversed(owned) if account not in busy][: len(owned) - share]
+            conn.executemany(STATEMENTS["release_lease"], [(account, NODE_ID) for account in excess])
+            if excess:
+                logger.info(f"节点 {NODE_ID} 释放 {len(excess)} 个用户的租约（存活节点 {nodes} 个，每个节点约 {share} 个用户）")
+        elif len(owned) < share:
+            claimed = conn.execute(
+                STATEMENTS["claim_leases"], (NODE_ID, expires_at, now, share - len(owned))
+            ).rowcount
+            if claimed:
+                logger.info(f"节点 {NODE_ID} 认领 {claimed} 个用户（存活节点 {nodes} 个，每个节点约 {share} 个用户）")
+
+        return {row[0] for row in conn.execute(STATEMENTS["owned_leases"], (NODE_ID, now))}
+
@@ -0,0 +1,62 @@
+import os
+
+TAIL_BLOCK_SIZE = 8192  # 反向读取时每次读取的字节数
+MAX_READ_BYTES = 256 * 1024  # 增量读取单次最多返回的字节数
+
+
+def tail_lines(path, lines):
+    """
+    读取文件最后 N 行
+
+    从文件末尾按块反向读取，直到读到足够的换行符，耗时只与返回内容的大小有关。
+    返回: (内容, 文件当前大小)
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        position = size
+        data = b""
+        # 末尾的换行符不算作一行，多读一个换行符以确定第一行的起点
+        while position > 0 and data.count(b"\n") <= lines:
+            read_size = min(TAIL_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+
+    if lines <= 0:
+        return "", size
+    # 只按 \n 分行，与 read_from 一致（str.splitlines 还会在 \r、\u2028 等字符处分行）
+    start = len(data) - 1 if data.endswith(b"\n") else len(data)
+    for _ in range(lines):
+        start = data.rfind(b"\n", 0, start)
+        if start < 0:
+            break
+    return data[start + 1:].decode("utf-8", errors="replace"), size
+
+
+def read_from(path, offset, max_bytes=MAX_READ_BYTES):
+    """
+    从指定字节偏移读取新增内容
+
+    只返回完整的行，未写完的最后一行留到下次读取。
+    offset 超过文件大小（文件被截断或重建）时从头读取。
+    返回: (内容, 下次读取的偏移)
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if offset > size:
+            offset = 0
+        if offset == size:
+            return "", offset
+        f.seek(offset)
+        data = f.read(max_bytes)
+
+    end = data.rfind(b"\n")
+    if end < 0:
+        # 单行超过 max_bytes 时原样返回，避免永远无法前进
+        if len(data) < max_bytes:
+            return "", offset
+        end = len(data) - 1
+    data = data[: end + 1]
+    return data.decode("utf-8", errors="replace"), offset + len(data)
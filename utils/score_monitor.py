@@ -1,9 +1,16 @@
 import json
+import time
+import asyncio
 import hashlib
 import requests
-from bs4 import BeautifulSoup
 from utils.crypto import decrypt_session
-from models import DatabaseManager
+from utils.score_parser import parse_scores
+from utils.session_manager import new_session, JWXT_BASE_URL
+from models import DatabaseManager, get_timestamp
+from utils.metrics import Counter, Histogram
+
+FETCH_DURATION = Histogram("monitor_fetch_scores_duration_seconds", "获取成绩页面耗时")
+FETCH_TOTAL = Counter("monitor_fetch_scores_total", "获取成绩页面次数，按结果分类（parsed/unchanged/expired/error）")
 
 
 def restore_session(encrypted_session, encryption_key):
@@ -11,7 +18,7 @@ def restore_session(encrypted_session, encryption_key):
     session_data = decrypt_session(encrypted_session, encryption_key)
     session_dict = json.loads(session_data)
 
-    session = requests.Session()
+    session = new_session()
     session.cookies.update(session_dict['cookies'])
     session.headers.update(session_dict['headers'])
     return session
@@ -20,7 +27,7 @@ def restore_session(encrypted_session, encryption_key):
 def serialize_session(session):
     """序列化session为JSON"""
     return json.dumps({
-        'cookies': dict(session.cookies),
+        'cookies': session.cookies.get_dict(),
         'headers': dict(session.headers)
     })
 
@@ -30,118 +37,267 @@ def check_session_expired(response_text):
     return "请输入验证码" in response_text
 
 
-def fetch_scores(session):
+def extract_table_html(page_text, table_id="dataList"):
+    """
+    截取页面中指定 id 的表格源码（不解析 HTML）
+
+    返回: 表格源码字符串，未找到返回 None
+    """
+    marker = page_text.find(f'id="{table_id}"')
+    if marker == -1:
+        return None
+    start = page_text.rfind("<table", 0, marker)
+    end = page_text.find("</table>", marker)
+    if start == -1 or end == -1:
+        return None
+    return page_text[start:end + len("</table>")]
+
+
+def page_fingerprint(response, table_html):
+    """
+    计算成绩页面的廉价指纹
+
+    优先使用服务器提供的 ETag / Last-Modified，否则只对成绩表格的源码计算哈希，
+    页面其他部分的变化不会影响指纹。
+    """
+    etag = response.headers.get("ETag")
+    if etag:
+        return f"etag:{etag}"
+    last_modified = response.headers.get("Last-Modified")
+    if last_modified:
+        return f"lm:{last_modified}"
+    return hashlib.sha256(table_html.encode()).hexdigest()
+
+
+# 参与成绩指纹计算的字段，页面上其他内容的变化不视为成绩变化
+FINGERPRINT_FIELDS = ('课程编号', '开课学期', '成绩', '成绩标识', '绩点', '学分', '补重学期')
+
+
+def score_fingerprint(scores):
+    """
+    计算成绩列表的规范化指纹
+
+    只使用成绩相关字段，空白归一化后按课程排序，与页面标记、行顺序无关。
+    """
+    rows = sorted(
+        "\x1f".join(" ".join(score.get(field, "").split()) for field in FINGERPRINT_FIELDS)
+        for score in scores
+    )
+    return hashlib.sha256("\x1e".join(rows).encode()).hexdigest()
+
+
+def fetch_scores(session, known_hash=None):
     """
     获取成绩页面并提取完整成绩信息
 
-    返回值: (page_hash, scores, expired)
-        - 正常获取: (hash, scores_list, False)
-        - session过期: (None, None, True)
-        - 网络异常/非200响应: (None, None, False) - 不刷新hash，不触发过期处理
+    参数:
+        session: 已登录的 session
+        known_hash: 数据库中保存的表格指纹 (scores.table_hash)，一致时跳过 HTML 解析
+
+    返回值: (page_hash, scores, expired, table_hash)
+        - 正常获取: (hash, scores_list, False, table_hash) - hash 为 score_fingerprint 规范化指纹
+        - 页面未变化: (None, None, False, table_hash) - 表格指纹与 known_hash 一致，未解析成绩
+        - session过期: (None, None, True, None)
+        - 网络异常/非200响应: (None, None, False, None) - 不刷新hash，不触发过期处理
     """
-    url = "http://zhjw.qfnu.edu.cn/jsxsd/kscj/cjcx_list"
+    started = time.monotonic()
+    result = _fetch_scores(session, known_hash)
+    FETCH_DURATION.observe(time.monotonic() - started)
+    FETCH_TOTAL.inc(outcome=_fetch_outcome(result))
+    return result
+
+
+def _fetch_outcome(result):
+    """fetch_scores 结果分类，用于统计"""
+    _, scores, expired, table_hash = result
+    if expired:
+        return "expired"
+    if scores is not None:
+        return "parsed"
+    if table_hash is not None:
+        return "unchanged"
+    return "error"
+
+
+def _fetch_scores(session, known_hash):
+    """fetch_scores 的实现"""
+    url = f"{JWXT_BASE_URL}/jsxsd/kscj/cjcx_list"
 
     try:
-        response = session.get(url, timeout=10)
+        headers = {}
+        if known_hash and known_hash.startswith("etag:"):
+            # 服务器支持 ETag 时发送条件请求，未变化时返回 304
+            headers["If-None-Match"] = known_hash[len("etag:"):]
+        response = session.get(url, headers=headers, timeout=10)
+
+        if response.status_code == 304 and known_hash:
+            return None, None, False, known_hash
 
         # 检查响应状态码，非200视为异常，不刷新hash
         if response.status_code != 200:
-            return None, None, False
+            return None, None, False, None
 
         # 检查session是否过期
         if check_session_expired(response.text):
-            return None, None, True
+            return None, None, True, None
 
         # 验证页面内容有效性（必须包含成绩表格）
-        soup = BeautifulSoup(response.text, 'html.parser')
-        table = soup.find('table', {'id': 'dataList'})
-        if not table:
+        table_html = extract_table_html(response.text)
+        if table_html is None:
             # 页面结构异常，可能是临时错误，不刷新hash
-            return None, None, False
-
-        # 页面有效，计算哈希并解析成绩
-        page_hash = hashlib.sha256(response.text.encode()).hexdigest()
-        scores = []
-
-        rows = table.find_all('tr')[1:]  # 跳过表头
-        for idx, row in enumerate(rows, 1):
-            cols = row.find_all('td')
-            if len(cols) >= 16:  # 确保有足够的列
-                score_info = {
-                    '序号': str(idx),
-                    '开课学期': cols[1].text.strip(),
-                    '课程编号': cols[2].text.strip(),
-                    '课程名称': cols[3].text.strip(),
-                    '分组名': cols[4].text.strip(),
-                    '成绩': cols[5].text.strip(),
-                    '成绩标识': cols[6].text.strip(),
-                    '学分': cols[7].text.strip(),
-                    '总学时': cols[8].text.strip(),
-                    '绩点': cols[9].text.strip(),
-                    '补重学期': cols[10].text.strip(),
-                    '考核方式': cols[11].text.strip(),
-                    '考试性质': cols[12].text.strip(),
-                    '课程属性': cols[13].text.strip(),
-                    '课程性质': cols[14].text.strip(),
-                    '课程类别': cols[15].text.strip(),
-                }
-                scores.append(score_info)
-
-        return page_hash, scores, False
+            return None, None, False, None
+
+        # 表格指纹未变化，无需解析
+        table_hash = page_fingerprint(response, table_html)
+        if table_hash == known_hash:
+            return None, None, False, table_hash
+
+        # 表格有变化，解析成绩并计算规范化指纹
+        scores = parse_scores(table_html)
+        page_hash = score_fingerprint(scores)
+
+        return page_hash, scores, False, table_hash
 
     except requests.exceptions.RequestException:
         # 网络异常（超时、连接失败等），不刷新hash
-        return None, None, False
+        return None, None, False, None
     except Exception:
         # 其他未知异常，不刷新hash
-        return None, None, False
+        return None, None, False, None
+
+
+async def fetch_scores_async(session, known_hash=None):
+    """
+    fetch_scores 的 asyncio 版本
+
+    请求在线程中执行，底层连接来自所有 session 共享的 keep-alive 连接池。
+    参数和返回值与 fetch_scores 相同，传入 known_hash 时同样可以跳过解析。
+    """
+    return await asyncio.to_thread(fetch_scores, session, known_hash=known_hash)
+
+
+def _diff_score_records(cursor, user_account, scores, legacy_course_ids=None):
+    """
+    将本次成绩与 score_records 做集合对比并写入
+
+    对比在 SQL 中完成：本次成绩写入临时表后与 score_records 关联查询，
+    找出新增课程和成绩/绩点发生变化的课程（重修、更正）。
+    每一行以 (课程编号, 开课学期, 考试性质, 补重学期) 区分，补考、重修与正常考试分别记录；
+    页面中完全重复的行只保留最后一行。
 
+    Args:
+        legacy_course_ids: 迁移前 reported_course_ids 中记录的课程编号。
+            该用户尚无 score_records 时用于初始化，其中的课程不再通知；为 None 时视为首次记录，不通知。
+    返回: 需要通知的成绩列表，成绩变化的课程附带 '原成绩' 字段
+    """
+    now = get_timestamp()
+    cursor.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS current_scores (
+            pos INTEGER, course_id TEXT, term TEXT, exam_type TEXT, retake_term TEXT, grade TEXT, gpa TEXT,
+            PRIMARY KEY (course_id, term, exam_type, retake_term)
+        )
+        """
+    )
+    cursor.execute("DELETE FROM current_scores")
+    cursor.executemany(
+        """
+        INSERT OR REPLACE INTO current_scores (pos, course_id, term, exam_type, retake_term, grade, gpa)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (pos, score['课程编号'], score['开课学期'], score['考试性质'], score['补重学期'], score['成绩'], score['绩点'])
+            for pos, score in enumerate(scores)
+        ],
+    )
+
+    cursor.execute("SELECT 1 FROM score_records WHERE user_account = ? LIMIT 1", (user_account,))
+    if cursor.fetchone() is None:
+        # 尚无成绩记录：首次记录或从 reported_course_ids 迁移
+        if legacy_course_ids is None:
+            changes = []
+        else:
+            known = set(legacy_course_ids)
+            changes = [score for score in scores if score['课程编号'] not in known]
+    else:
+        cursor.execute(
+            """
+            SELECT c.pos, r.grade AS old_grade, r.course_id IS NULL AS is_new
+            FROM current_scores c
+            LEFT JOIN score_records r
+                ON r.user_account = ? AND r.course_id = c.course_id AND r.term = c.term
+                AND r.exam_type = c.exam_type AND r.retake_term = c.retake_term
+            WHERE r.course_id IS NULL OR r.grade IS NOT c.grade OR r.gpa IS NOT c.gpa
+            ORDER BY c.pos
+            """,
+            (user_account,),
+        )
+        changes = []
+        for row in cursor.fetchall():
+            score = scores[row['pos']]
+            if not row['is_new']:
+                score = dict(score, 原成绩=row['old_grade'])
+            changes.append(score)
+
+    cursor.execute(
+        """
+        INSERT INTO score_records (
+            user_account, course_id, term, exam_type, retake_term, grade, gpa, first_seen_at, updated_at
+        )
+        SELECT ?, course_id, term, exam_type, retake_term, grade, gpa, ?, ? FROM current_scores WHERE true
+        ON CONFLICT (user_account, course_id, term, exam_type, retake_term) DO UPDATE SET
+            grade = excluded.grade, gpa = excluded.gpa, updated_at = excluded.updated_at
+        WHERE score_records.grade IS NOT excluded.grade OR score_records.gpa IS NOT excluded.gpa
+        """,
+        (user_account, now, now),
+    )
+    return changes
+
+
+def compare_scores(user_account, page_hash, scores, conn=None, table_hash=None):
+    """对比成绩变化，使用成绩指纹判断，按课程记录到 score_records
+
+    成绩指纹不同时才进行逐课程对比，可识别新课程以及已有课程的成绩变化。
 
-def compare_scores(user_account, page_hash, scores, conn=None):
-    """对比成绩变化，使用页面哈希判断并记录已播报的课程编号
-    
     Args:
         user_account: 用户账号
-        page_hash: 页面哈希
+        page_hash: 成绩规范化指纹（score_fingerprint）
         scores: 成绩列表
         conn: 可选的数据库连接，如果提供则使用该连接，否则创建新连接
+        table_hash: 成绩表格的廉价指纹，保存后用于下次跳过解析
+    返回: 需要通知的成绩列表（新课程及成绩变化的课程）
     """
     def _do_compare(cursor):
-        cursor.execute("SELECT page_hash, reported_course_ids FROM scores WHERE user_account = ? ORDER BY updated_at DESC LIMIT 1", (user_account,))
+        cursor.execute("SELECT page_hash, table_hash, reported_course_ids FROM scores WHERE user_account = ? ORDER BY updated_at DESC LIMIT 1", (user_account,))
         row = cursor.fetchone()
 
         if row:
-            old_page_hash = row['page_hash']
-            reported_course_ids = json.loads(row['reported_course_ids'])
+            # 如果成绩指纹不同，说明有变化
+            if row['page_hash'] != page_hash:
+                legacy_course_ids = json.loads(row['reported_course_ids'] or "[]")
+                changes = _diff_score_records(cursor, user_account, scores, legacy_course_ids)
 
-            # 如果页面哈希不同，说明有变化
-            if old_page_hash != page_hash:
-                # 提取当前所有课程编号
-                current_course_ids = [score['课程编号'] for score in scores]
-
-                # 找出未播报的新成绩
-                new_courses = [score for score in scores if score['课程编号'] not in reported_course_ids]
-
-                # 更新数据库：覆盖页面哈希，更新已播报课程编号列表
-                updated_reported_ids = json.dumps(current_course_ids)
+                # 更新成绩指纹
                 cursor.execute(
-                    "UPDATE scores SET page_hash = ?, reported_course_ids = ?, updated_at = CURRENT_TIMESTAMP WHERE user_account = ?",
-                    (page_hash, updated_reported_ids, user_account)
+                    "UPDATE scores SET page_hash = ?, table_hash = ?, updated_at = ? WHERE user_account = ?",
+                    (page_hash, table_hash, get_timestamp(), user_account)
                 )
-
-                return new_courses
+                return changes
             else:
-                # 页面哈希相同，无变化
+                # 成绩指纹相同，无变化；仅在表格指纹变化时记录，便于下次跳过解析
+                if table_hash is not None and row['table_hash'] != table_hash:
+                    cursor.execute(
+                        "UPDATE scores SET table_hash = ? WHERE user_account = ?",
+                        (table_hash, user_account)
+                    )
                 return []
         else:
-            # 首次记录，保存页面哈希和所有课程编号
-            current_course_ids = [score['课程编号'] for score in scores]
-            reported_course_ids = json.dumps(current_course_ids)
+            # 首次记录，保存成绩指纹和所有课程，首次不通知
+            _diff_score_records(cursor, user_account, scores)
             cursor.execute(
-                "INSERT INTO scores (user_account, page_hash, reported_course_ids) VALUES (?, ?, ?)",
-                (user_account, page_hash, reported_course_ids)
+                "INSERT INTO scores (user_account, page_hash, table_hash, updated_at) VALUES (?, ?, ?, ?)",
+                (user_account, page_hash, table_hash, get_timestamp())
             )
-            # 首次不通知
             return []
 
     # 如果提供了连接，直接使用；否则创建新连接
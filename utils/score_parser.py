@@ -0,0 +1,145 @@
+import os
+import re
+import html
+from functools import lru_cache
+from bs4 import BeautifulSoup
+from utils.logger import logger
+
+try:
+    import lxml.html as lxml_html
+except ImportError:  # lxml 为可选加速依赖
+    lxml_html = None
+
+# 成绩表格第 2~16 列对应的字段（第 1 列为页面序号，由解析器重新编号）
+SCORE_FIELDS = [
+    '开课学期',
+    '课程编号',
+    '课程名称',
+    '分组名',
+    '成绩',
+    '成绩标识',
+    '学分',
+    '总学时',
+    '绩点',
+    '补重学期',
+    '考核方式',
+    '考试性质',
+    '课程属性',
+    '课程性质',
+    '课程类别',
+]
+MIN_COLUMNS = len(SCORE_FIELDS) + 1
+
+# 解析后端: stream（默认）、lxml、bs4
+SCORE_PARSER = os.getenv("SCORE_PARSER", "stream")
+
+_TOKEN_RE = re.compile(r'<(/?)(tr|td)\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]*>')
+_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+
+
+def _cell_text(raw):
+    """提取单元格纯文本，与 BeautifulSoup 的 .text.strip() 结果一致"""
+    if '<' in raw:
+        raw = _TAG_RE.sub('', _COMMENT_RE.sub('', raw))
+    if '&' in raw:
+        raw = html.unescape(raw)
+    return raw.strip()
+
+
+def _build_scores(rows):
+    """将单元格文本行转换为成绩字典列表，跳过表头和列数不足的行"""
+    scores = []
+    for idx, cols in enumerate(rows[1:], 1):  # 跳过表头
+        if len(cols) >= MIN_COLUMNS:  # 确保有足够的列
+            score_info = {'序号': str(idx)}
+            score_info.update(zip(SCORE_FIELDS, cols[1:MIN_COLUMNS]))
+            scores.append(score_info)
+    return scores
+
+
+def parse_stream(table_html):
+    """
+    流式解析成绩表格
+
+    只扫描 tr/td 标签，不构建 DOM 树，单元格内的嵌套标签会被去除。
+    """
+    rows = []
+    cells = None
+    cell_start = None
+
+    for match in _TOKEN_RE.finditer(table_html):
+        closing, tag = match.group(1), match.group(2).lower()
+
+        # 任何 tr/td 标签都会结束当前单元格（兼容省略 </td> 的写法）
+        if cell_start is not None:
+            cells.append(_cell_text(table_html[cell_start:match.start()]))
+            cell_start = None
+
+        if tag == 'tr':
+            if not closing:
+                cells = []
+                rows.append(cells)
+        elif not closing and cells is not None:
+            cell_start = match.end()
+
+    return _build_scores(rows)
+
+
+def parse_lxml(table_html):
+    """使用 lxml 解析成绩表格"""
+    table = lxml_html.fragment_fromstring(table_html)
+    rows = [
+        [td.text_content().strip() for td in tr.iter('td')]
+        for tr in table.iter('tr')
+    ]
+    return _build_scores(rows)
+
+
+def parse_bs4(table_html):
+    """使用 BeautifulSoup (html.parser) 解析成绩表格"""
+    soup = BeautifulSoup(table_html, 'html.parser')
+    table = soup.find('table', {'id': 'dataList'})
+    if not table:
+        return []
+    rows = [
+        [td.text.strip() for td in tr.find_all('td')]
+        for tr in table.find_all('tr')
+    ]
+    return _build_scores(rows)
+
+
+PARSERS = {
+    'stream': parse_stream,
+    'lxml': parse_lxml,
+    'bs4': parse_bs4,
+}
+
+
+def get_parser(backend=None):
+    """获取解析函数，lxml 未安装时回退到 stream"""
+    return _resolve_parser(backend or SCORE_PARSER)
+
+
+@lru_cache(maxsize=None)
+def _resolve_parser(backend):
+    """解析后端名称，每个名称只解析（并告警）一次"""
+    if backend == 'lxml' and lxml_html is None:
+        logger.warning("未安装 lxml，成绩解析回退到 stream 后端")
+        backend = 'stream'
+    if backend not in PARSERS:
+        logger.warning(f"未知的成绩解析后端 {backend}，使用 stream 后端")
+        backend = 'stream'
+    return PARSERS[backend]
+
+
+def parse_scores(table_html, backend=None):
+    """
+    解析成绩表格
+
+    参数:
+        table_html: dataList 表格源码（见 score_monitor.extract_table_html）
+        backend: 解析后端，默认使用环境变量 SCORE_PARSER
+    返回: 成绩字典列表
+    """
+    return get_parser(backend)(table_html)
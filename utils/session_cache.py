@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from utils.score_monitor import restore_session
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1000))  # 最多缓存的用户 session 数
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", 1800))  # 缓存有效期（秒）
+
+
+def _cookie_snapshot(session):
+    """Cookie 快照（同名 Cookie 可能存在于不同路径，不能直接转换为 dict）"""
+    return sorted((c.domain, c.path, c.name, c.value) for c in session.cookies)
+
+
+class _Entry:
+    __slots__ = ("session", "encrypted_session", "cookies", "expires_at")
+
+    def __init__(self, session, encrypted_session, ttl):
+        self.session = session
+        self.encrypted_session = encrypted_session
+        self.cookies = _cookie_snapshot(session)
+        self.expires_at = time.monotonic() + ttl
+
+
+class SessionCache:
+    """已解密用户 session 的 LRU 缓存
+
+    缓存项以数据库中的加密 session 为版本号：数据库中的 session 被替换（重新登录、重新导入）后，
+    旧缓存自动失效。缓存同时记录 Cookie 快照，用于判断 session 是否需要写回数据库。
+    """
+
+    def __init__(self, max_size=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_account, encrypted_session):
+        """获取缓存的 session，未命中、已过期或版本不一致时返回 None"""
+        with self._lock:
+            entry = self._entries.get(user_account)
+            if (
+                entry is None
+                or entry.encrypted_session != encrypted_session
+                or entry.expires_at < time.monotonic()
+            ):
+                if entry is not None:
+                    del self._entries[user_account]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_account)
+            self.hits += 1
+            return entry.session
+
+    def put(self, user_account, encrypted_session, session):
+        """缓存 session，超出容量时淘汰最久未使用的用户"""
+        with self._lock:
+            self._entries[user_account] = _Entry(session, encrypted_session, self.ttl)
+            self._entries.move_to_end(user_account)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def cookies_changed(self, user_account, session):
+        """session 的 Cookie 是否与上次保存到数据库时不同"""
+        with self._lock:
+            entry = self._entries.get(user_account)
+            return entry is None or entry.cookies != _cookie_snapshot(session)
+
+    def mark_persisted(self, user_account, encrypted_session, session):
+        """session 已写回数据库：更新版本号和 Cookie 快照"""
+        with self._lock:
+            entry = self._entries.get(user_account)
+            if entry is not None and entry.session is session:
+                entry.encrypted_session = encrypted_session
+                entry.cookies = _cookie_snapshot(session)
+
+    def invalidate(self, user_account):
+        """移除用户的缓存（重新登录、删除、停用时调用）"""
+        with self._lock:
+            self._entries.pop(user_account, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+session_cache = SessionCache()
+
+
+def get_user_session(user_account, encrypted_session, encryption_key):
+    """
+    获取用户 session，优先使用缓存
+
+    命中缓存时跳过 AES-GCM 解密、JSON 解析和 session 构建。
+    """
+    session = session_cache.get(user_account, encrypted_session)
+    if session is None:
+        session = restore_session(encrypted_session, encryption_key)
+        session_cache.put(user_account, encrypted_session, session)
+    return session
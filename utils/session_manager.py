@@ -1,10 +1,73 @@
+import os
 from requests import Session
+from requests.adapters import HTTPAdapter
 import threading
 
+# 教务系统地址，可指向本地模拟服务器（见 benchmarks/simulator.py）
+JWXT_BASE_URL = os.getenv("JWXT_BASE_URL", "http://zhjw.qfnu.edu.cn").rstrip("/")
+
+# 共享连接池大小，默认与检查线程数一致
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", os.getenv("SWEEP_WORKERS", 8)))
+
+# 登录使用的默认请求头
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36 Edg/132.0.0.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Connection": "keep-alive",
+}
+
 # 全局session变量
 _session = None
 _session_lock = threading.Lock()
 
+# 所有用户 session 共享的连接池
+_shared_adapter = None
+_adapter_lock = threading.Lock()
+
+
+class SharedHTTPAdapter(HTTPAdapter):
+    """跨 session 共享的连接适配器
+
+    连接池随进程存活，单个 session 关闭时不关闭连接池。
+    """
+
+    def close(self):
+        pass
+
+
+def get_shared_adapter():
+    """获取共享连接适配器，首次调用时创建"""
+    global _shared_adapter
+    if _shared_adapter is None:
+        with _adapter_lock:
+            if _shared_adapter is None:
+                _shared_adapter = SharedHTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=HTTP_POOL_SIZE,
+                    pool_block=True,  # 连接数达到上限时等待，而不是新建连接
+                )
+    return _shared_adapter
+
+
+def new_session():
+    """创建使用共享连接池的 session
+
+    每个 session 拥有独立的 Cookie，但底层 TCP 连接（keep-alive）在所有 session 间复用。
+    """
+    session = Session()
+    adapter = get_shared_adapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def new_login_session():
+    """创建用于登录的独立 session，可与其他登录并发进行而互不影响 Cookie"""
+    session = new_session()
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
 
 def init_session():
     """初始化全局会话"""
@@ -12,14 +75,7 @@ def init_session():
     with _session_lock:
         if _session is None:
             _session = Session()
-            _session.headers.update(
-                {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36 Edg/132.0.0.0",
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-                    "Connection": "keep-alive",
-                }
-            )
+            _session.headers.update(DEFAULT_HEADERS)
         return _session
 
 